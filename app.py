@@ -1,30 +1,50 @@
 #!/usr/bin/env python3
+import time
+STARTED = time.perf_counter_ns()
 
 import os
 import sys
-from collections import defaultdict
-from datetime import timedelta
 
 import PyQt5.QtCore
 from PyQt5.QtCore import (
-        pyqtSignal,
+        Qt, pyqtSignal, QTimer, QFileSystemWatcher, QStringListModel,
 )
 from PyQt5.QtWidgets import (
         QApplication, QWidget, QTabWidget,
         QVBoxLayout, QHBoxLayout,
         QLabel, QMessageBox, QGroupBox,
         QLineEdit, QPushButton, QFileDialog, QComboBox, QCheckBox, QSpinBox,
+        QProgressBar, QCompleter, QInputDialog,
 )
-from datasource import Journal, get_value
-
-import matplotlib
-matplotlib.use("Qt5Agg")
-
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
-from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
-from matplotlib.pyplot import subplots
-from matplotlib.figure import Figure
-from matplotlib import colormaps
+import profiling
+from scheduler import Scheduler
+from worker import Worker
+
+# matplotlib, numpy and ledger are only imported once they are needed, so that
+# the window shows up without waiting for them
+
+# how long to wait for more changes before drawing, in ms
+DRAW_DELAY = 50
+# and before catching up with changes to a followed journal
+FOLLOW_DELAY = 500
+# how often the profiling panel shows the latest timings
+PROFILE_INTERVAL = 1000
+
+def is_url(filename):
+    return filename.startswith(("http://", "https://"))
+
+def open_journal(filenames, effective_date, progress=None):
+    """The journal in filenames, or served at it by server.py, several of
+       them are merged"""
+    if len(filenames) > 1:
+        from datasource import MergedJournal
+        return MergedJournal(filenames, effective_date=effective_date, progress=progress)
+    filename = filenames[0]
+    if is_url(filename):
+        from remote import RemoteJournal
+        return RemoteJournal(filename, effective_date=effective_date, progress=progress)
+    from datasource import Journal
+    return Journal(filename, effective_date=effective_date, progress=progress)
 
 def debug():
     from PyQt5.QtCore import pyqtRemoveInputHook; pyqtRemoveInputHook()
@@ -34,12 +54,13 @@ class Options(QWidget):
     reset = pyqtSignal()
     redraw = pyqtSignal()
 
-    def __init__(self, window):
+    def __init__(self, window, filenames=None):
         super(Options, self).__init__()
         self.window = window
         layout = QVBoxLayout(self)
 
-        self.button = QPushButton("Click to select a file to open", self)
+        self.button = QPushButton("Click to select files to open", self)
+        self.button.setToolTip("Several files are shown merged")
         self.button.clicked.connect(self.select_file)
 
         layout.addWidget(self.button)
@@ -48,6 +69,8 @@ class Options(QWidget):
 
         label = QLabel("Show in terms of")
         self.show_currency = QComboBox()
+        self.show_currency.currentTextChanged.connect(
+                lambda commodity: self.scheduler.update(commodity=commodity))
 
         currencyLayout.addWidget(label)
         currencyLayout.addWidget(self.show_currency)
@@ -55,10 +78,21 @@ class Options(QWidget):
         viewLayout = QHBoxLayout()
 
         self.merge = QCheckBox("Merge")
-        self.merge.stateChanged.connect(self.reset)
+        self.merge.stateChanged.connect(lambda: self.scheduler.update(merge=self.merge.isChecked()))
 
         self.effective_date = QCheckBox("Use Effective Dates")
-        self.effective_date.stateChanged.connect(self.reset)
+        self.effective_date.stateChanged.connect(
+                lambda: self.scheduler.update(effective=self.effective_date.isChecked()))
+
+        self.overlay = QCheckBox("Overlay")
+        self.overlay.setToolTip("Show each of the files opened on its own")
+        self.overlay.setEnabled(False)
+        self.overlay.stateChanged.connect(
+                lambda: self.scheduler.update(overlay=self.overlay.isChecked()))
+
+        self.follow = QCheckBox("Follow")
+        self.follow.setToolTip("Keep up with changes to the file")
+        self.follow.stateChanged.connect(self.follow_changed)
 
         depthLayout = QHBoxLayout()
 
@@ -67,7 +101,7 @@ class Options(QWidget):
         self.depth_limit.setSpecialValueText("Unlimited")
         self.depth_limit.setMinimum(0)
         self.depth_limit.setValue(0)
-        self.depth_limit.valueChanged.connect(self.redraw)
+        self.depth_limit.valueChanged.connect(lambda depth: self.scheduler.update(depth=depth))
 
         depthLayout.addWidget(label)
         depthLayout.addWidget(self.depth_limit)
@@ -75,45 +109,161 @@ class Options(QWidget):
         viewLayout.addLayout(currencyLayout)
         viewLayout.addWidget(self.merge)
         viewLayout.addWidget(self.effective_date)
+        viewLayout.addWidget(self.overlay)
+        viewLayout.addWidget(self.follow)
         viewLayout.addLayout(depthLayout)
 
         filterLayout = QHBoxLayout()
 
         label = QLabel("Filter:")
         self.filter = QLineEdit()
+        self.filter.editingFinished.connect(lambda: self.scheduler.update(filter=self.filter.text()))
+
+        # what the tab shown has plotted, see PlotTab.export
+        self.export = QPushButton("Export...")
+        self.export.setEnabled(False)
 
         filterLayout.addWidget(label)
         filterLayout.addWidget(self.filter)
+        filterLayout.addWidget(self.export)
 
-        layout.addLayout(viewLayout)
-        layout.addLayout(filterLayout)
-
-        if app.arguments():
-            self.select_file(app.arguments()[-1])
-
-    def select_file(self, selected_file=None):
-        if not selected_file:
-            selected_file, _ = QFileDialog(self, "Ledger file to open").getOpenFileName()
-        if selected_file:
-            try:
-                journal = Journal(selected_file, effective_date=self.effective_date)
-                self.journal = journal
-                self.effective_date.stateChanged.connect(journal.set_effective_date)
+        statusLayout = QHBoxLayout()
 
-                self.button.setText(selected_file)
-                self.filename = selected_file
-                self.window.setWindowTitle("Ledger visualizer - " + selected_file)
+        self.status = QLabel()
+        self.progress = QProgressBar()
+        # we do not know how many postings there are until we are done
+        self.progress.setRange(0, 0)
+        self.progress.hide()
 
-                self.filter.editingFinished.connect(self.reset)
+        statusLayout.addWidget(self.status)
+        statusLayout.addWidget(self.progress)
 
-                self.show_currency.addItems(journal.commodities.keys())
-                self.show_currency.currentTextChanged.connect(self.reset)
+        layout.addLayout(viewLayout)
+        layout.addLayout(filterLayout)
+        layout.addLayout(statusLayout)
+
+        # the signals above only ever get connected the once, here
+        self.scheduler = Scheduler(self)
+        self.scheduler.reset.connect(self.reset)
+        self.scheduler.redraw.connect(self.redraw)
+        self.state = self.scheduler.state
+
+        self.worker = Worker(self)
+        self.worker.busy.connect(self.busy)
+        self.worker.progress.connect(self.show_progress)
+
+        self.journal = None
+        # what the last job had to say, shown once there is nothing left to do
+        self.notice = ""
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.fileChanged.connect(self.changed)
+        self.follow_timer = QTimer(self)
+        self.follow_timer.setSingleShot(True)
+        self.follow_timer.setInterval(FOLLOW_DELAY)
+        self.follow_timer.timeout.connect(self.refresh)
+
+        if filenames:
+            # once the event loop runs, the window comes first
+            QTimer.singleShot(0, lambda: self.select_file(filenames))
+
+    def select_file(self, selected_files=None):
+        if not selected_files:
+            selected_files, _ = QFileDialog(self, "Ledger files to open").getOpenFileNames()
+        if selected_files:
+            selected = " + ".join(selected_files)
+            effective_date = self.effective_date.isChecked()
+            self.worker.submit(self,
+                    lambda job: open_journal(selected_files, effective_date, job.progress),
+                    lambda journal: self.loaded(selected_files, journal),
+                    self.load_failed, "Loading " + selected)
+
+    def loaded(self, selected_files, journal):
+        self.journal = journal
+
+        self.filenames = selected_files
+        self.filename = " + ".join(selected_files)
+        self.button.setText(self.filename)
+        self.window.setWindowTitle("Ledger visualizer - " + self.filename)
+        self.overlay.setEnabled(len(selected_files) > 1)
+
+        # not a change for every symbol added
+        self.show_currency.blockSignals(True)
+        self.show_currency.clear()
+        self.show_currency.addItems(journal.symbols)
+        self.show_currency.blockSignals(False)
+
+        self.export.setEnabled(True)
+        self.watch()
+        self.scheduler.update(journal=journal, commodity=self.show_currency.currentText(),
+                              effective=self.effective_date.isChecked())
+
+    def watch(self):
+        """Has the watcher on the journal and the files it includes while
+           following it"""
+        files = self.watcher.files()
+        if files:
+            self.watcher.removePaths(files)
+        if not (self.follow.isChecked() and self.journal):
+            return
+        if is_url(self.filename):
+            # nothing to watch, ask the server now and then
+            self.follow_timer.start()
+        else:
+            import cache
+            self.watcher.addPaths([name for filename in self.filenames
+                                   for name in cache.journal_files(filename)])
+
+    def follow_changed(self):
+        self.watch()
+        if self.follow.isChecked():
+            # catch up with what changed while not following
+            self.follow_timer.start()
+
+    def changed(self):
+        # there tend to be a few writes in a row
+        self.follow_timer.start()
+
+    def refresh(self):
+        journal = self.journal
+        if not journal:
+            return
+        self.worker.submit(self.watcher, lambda job: journal.refresh(job.progress),
+                self.refreshed, self.load_failed, "Catching up with " + self.filename)
 
-                self.reset.emit()
-            except RuntimeError:
-                message = QMessageBox(self)
-                message.setText("Ledger could not parse the selected file")
-                message.exec()
+    def refreshed(self, changed):
+        if not changed:
+            if is_url(self.filename):
+                self.watch()
+            return
+        # files replaced rather than written to are not watched any more
+        self.watch()
+
+        self.show_currency.blockSignals(True)
+        for symbol in self.journal.symbols:
+            if self.show_currency.findText(symbol) < 0:
+                self.show_currency.addItem(symbol)
+        self.show_currency.blockSignals(False)
+        self.scheduler.invalidate()
+
+    def load_failed(self, exception):
+        message = QMessageBox(self)
+        if isinstance(exception, OSError):
+            message.setText("Could not open the journal: {}".format(exception))
+        elif isinstance(exception, RuntimeError):
+            message.setText("Ledger could not parse the selected file")
+        else:
+            message.setText("Could not load the journal: {}: {}".format(
+                    type(exception).__name__, exception))
+        message.exec()
+
+    def busy(self, busy):
+        self.progress.setVisible(busy)
+        if not busy:
+            self.status.setText(self.notice)
+            self.notice = ""
+
+    def show_progress(self, description, count):
+        self.status.setText("{} ({} postings)".format(description, count))
 
 class CommodityBox(QGroupBox):
     changed = pyqtSignal()
@@ -139,414 +289,605 @@ class CommodityBox(QGroupBox):
         return checkbox and checkbox.isChecked()
 
     def reset(self):
-        for checkbox in self.checkboxes.values():
-            self.layout.removeWidget(checkbox)
-        self.checkboxes = {}
+        symbols = self.options.journal.symbols
+        if list(self.checkboxes) == symbols:
+            return
 
-        commodities = self.options.journal.commodities
-        for commodity in commodities.keys():
-            checkbox = QCheckBox(commodity, self)
+        # keep the boxes (and their state) of the commodities still around
+        self.blockSignals(True)
+        for commodity in list(self.checkboxes):
+            if commodity not in symbols:
+                checkbox = self.checkboxes.pop(commodity)
+                self.layout.removeWidget(checkbox)
+                checkbox.deleteLater()
+
+        checkboxes, self.checkboxes = self.checkboxes, {}
+        for commodity in symbols:
+            checkbox = checkboxes.get(commodity)
+            if checkbox is None:
+                checkbox = QCheckBox(commodity, self)
+                checkbox.stateChanged.connect(self.changed)
             self.checkboxes[commodity] = checkbox
             self.layout.addWidget(checkbox)
-            checkbox.stateChanged.connect(self.changed)
+        self.blockSignals(False)
+
+class PlotTab(QWidget):
+    """A figure and its toolbar, the artists plotted are kept by key so a
+       redraw only updates what changed and the drawing itself is deferred
+       until the changes stop coming in. The figure is only built once the
+       tab is first shown, and a hidden tab only computes and redraws once
+       it is shown again."""
+    # what export.py can write of what the tab shows
+    DATASETS = ()
 
-class GraphTab(QWidget):
     def __init__(self, options):
-        super(GraphTab, self).__init__()
+        super(PlotTab, self).__init__()
         self.options = options
-        self.options.reset.connect(self.reset)
-        self.options.redraw.connect(self.redraw)
-
-        self.commodities = CommodityBox(options)
-        self.commodities.changed.connect(self.redraw)
+        self.options.reset.connect(self.reset_when_shown)
+        self.options.redraw.connect(self.redraw_when_shown)
+
+        # what is owed for while hidden: None, "redraw" or "reset"
+        self.stale = None
+        self.fig = None
+        self.graphLayout = QVBoxLayout()
+
+        self.lines = {}
+        self.bars = {}
+        # what the lines would show at full detail
+        self.full = {}
+
+        self.draw_timer = QTimer(self)
+        self.draw_timer.setSingleShot(True)
+        self.draw_timer.setInterval(DRAW_DELAY)
+        self.draw_timer.timeout.connect(self.draw)
+
+        # zooming, panning or resizing changes how much of the lines can be seen
+        self.detail_timer = QTimer(self)
+        self.detail_timer.setSingleShot(True)
+        self.detail_timer.setInterval(DRAW_DELAY)
+        self.detail_timer.timeout.connect(self.refine)
+
+    def build(self):
+        import matplotlib
+        matplotlib.use("Qt5Agg")
+        from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+        from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
+        from matplotlib.figure import Figure
 
         self.fig = Figure()
         self.ax = self.fig.add_subplot(111)
+        self.ax.grid(True)
 
         self.canvas = FigureCanvas(self.fig)
         self.canvas.setParent(self)
+        # draw_idle draws when Qt gets to it, that is what gets timed
+        draw = self.canvas.draw
+        self.canvas.draw = lambda: self.timed_draw(draw)
 
         self.mpl_toolbar = NavigationToolbar(self.canvas, self)
-        self.cmap = colormaps['gist_ncar']
-
-        graphLayout = QVBoxLayout()
-        graphLayout.addWidget(self.canvas)
-        graphLayout.addWidget(self.mpl_toolbar)
 
-        layout = QHBoxLayout(self)
-        layout.addWidget(self.commodities)
-        layout.addLayout(graphLayout)
-
-        self.running_total = None
+        self.graphLayout.addWidget(self.canvas)
+        self.graphLayout.addWidget(self.mpl_toolbar)
+
+        self.ax.callbacks.connect('xlim_changed', lambda ax: self.detail_timer.start())
+        self.canvas.mpl_connect('resize_event', lambda event: self.detail_timer.start())
+
+    def showEvent(self, event):
+        super(PlotTab, self).showEvent(event)
+        if self.fig is None:
+            # let the window paint before matplotlib gets loaded
+            QTimer.singleShot(0, self.ensure_figure)
+            # building the figure plots what is there anyway
+            if self.stale == "redraw":
+                self.stale = None
+            if self.stale:
+                QTimer.singleShot(0, self.catch_up)
+        else:
+            # before what is out of date gets painted
+            self.catch_up()
+
+    def reset_when_shown(self):
+        if self.isVisible():
+            self.stale = None
+            self.reset()
+        else:
+            self.stale = "reset"
+
+    def redraw_when_shown(self):
+        if self.isVisible():
+            self.redraw()
+        elif self.stale is None:
+            self.stale = "redraw"
+
+    def catch_up(self):
+        stale, self.stale = self.stale, None
+        if stale == "reset":
+            self.reset()
+        elif stale == "redraw":
+            self.redraw()
+
+    def ensure_figure(self):
+        if self.fig is not None:
+            return
+        with profiling.span(type(self).__name__ + ".build"):
+            self.build()
+        self.replot()
 
     def reset(self):
-        options = self.options
-        self.commodity = options.show_currency.currentText()
-        self.merge = bool(self.commodity and options.merge.isChecked())
-
-        filter = options.filter.text()
-        self.running_total, self.total = options.journal.time_series(filter, self.commodity, self.merge)
-        self.redraw()
+        pass
 
     def redraw(self):
-        self.ax.clear()
-        self.ax.grid(True)
-        if not self.running_total:
+        pass
+
+    def sources(self):
+        """The sources to compute the series of, [None] for all of them"""
+        journal = self.options.journal
+        if self.options.state.overlay and len(journal.sources) > 1:
+            return list(range(len(journal.sources)))
+        return [None]
+
+    def export_settings(self):
+        """What export.export needs to write what the tab shows"""
+        state = self.options.state
+        return dict(filter=state.filter, commodity=state.commodity, depth=state.depth,
+                    merge=state.merge, effective=state.effective)
+
+    def export(self):
+        options = self.options
+        if not options.journal or not self.DATASETS:
+            return
+        name = self.DATASETS[0]
+        if len(self.DATASETS) > 1:
+            name, chosen = QInputDialog.getItem(self, "Export", "Series to export",
+                                                self.DATASETS, 0, False)
+            if not chosen:
+                return
+        filename, _ = QFileDialog.getSaveFileName(self, "Export " + name, name + ".csv",
+                "CSV (*.csv);;Parquet (*.parquet);;Arrow (*.arrow)")
+        if not filename:
             return
 
-        lines = len(self.total)
-        colors = map(self.cmap, ((x+0.5)/lines for x in range(lines)))
+        import export
+        journal, settings = options.journal, self.export_settings()
+        def exported(rows):
+            options.notice = "Exported {} rows to {}".format(rows, filename)
+        options.worker.submit((self, "export"),
+                lambda job: export.export(journal, filename, name, progress=job.progress, **settings),
+                exported, self.export_failed, "Exporting " + filename)
+
+    def failed(self, exception):
+        """What the tab shows could not be computed: the server went away,
+           ledger rejected the filter or the journal is broken"""
+        if isinstance(exception, (OSError, RuntimeError, ValueError)):
+            text = str(exception)
+        else:
+            text = "{}: {}".format(type(exception).__name__, exception)
+        QMessageBox.warning(self, "Ledger visualizer", "Could not compute what to show: " + text)
+
+    def export_failed(self, exception):
+        if not isinstance(exception, (OSError, RuntimeError, ValueError)):
+            raise exception
+        QMessageBox.warning(self, "Export", "Could not export: {}".format(exception))
+
+    def replot(self):
+        """Plots whatever has been computed onto the figure just built"""
+        self.redraw()
 
-        for color, (commodity, amount) in zip(colors, sorted(self.total.items(), key=lambda x: x[1].number(), reverse=True)):
-            if commodity not in self.commodities:
+    def schedule_draw(self):
+        self.draw_timer.start()
+
+    def draw(self):
+        self.canvas.draw_idle()
+
+    def timed_draw(self, draw):
+        with profiling.span(type(self).__name__ + ".draw"):
+            if profiling.enabled:
+                points = sum(len(line.get_xdata()) for line in self.lines.values() if line.get_visible())
+                profiling.count(points=points, patches=len(self.ax.patches))
+            draw()
+
+    def plot_lines(self, lines):
+        """Makes the lines on the axes the ones in lines, a list of
+           (key, dates, values, properties), reusing those with the same key.
+           Only as many points are drawn as can be told apart on screen"""
+        from postings import downsample, to_datetime64
+        for key in set(self.lines) - {line[0] for line in lines}:
+            self.lines.pop(key).remove()
+            del self.full[key]
+
+        for key, dates, values, properties in lines:
+            self.full[key] = dates, values
+            shown = downsample(dates, values, self.resolution())
+            x, y = to_datetime64(dates[shown]), values[shown]
+
+            line = self.lines.get(key)
+            if line is None:
+                self.lines[key], = self.ax.plot_date(x, y, fmt='o-', **properties)
+            else:
+                line.set_data(x, y)
+                line.update(properties)
+        self.rescale()
+
+    def plot_bars(self, bars, width):
+        """Same as plot_lines for bars, a list of (key, x, height, bottom,
+           properties), bars are only replaced when their count changes"""
+        for key in set(self.bars) - {bar[0] for bar in bars}:
+            self.bars.pop(key).remove()
+
+        for key, x, height, bottom, properties in bars:
+            container = self.bars.get(key)
+            if container is not None and len(container) != len(x):
+                self.bars.pop(key).remove()
+                container = None
+
+            if container is None:
+                self.bars[key] = self.ax.bar(x, height, width, bottom=bottom, **properties)
                 continue
-            series = self.running_total[commodity]
-            x = sorted(series.keys())
-            y = [series[i].number() for i in x]
-            label = ("%s (%." + str(amount.commodity.precision) + "f %s)") % (commodity, amount.number(), amount.commodity.symbol)
-            self.ax.plot_date(x, y, fmt='o-', color=color, label=label)
-
-        if self.commodity:
-            self.ax.set_ylabel(self.commodity)
-        self.ax.legend(loc='upper left')
-        self.fig.canvas.draw()
-
-class AccountTab(QWidget):
-    def __init__(self, options):
-        super(AccountTab, self).__init__()
-        self.options = options
-        self.options.reset.connect(self.reset)
-        self.options.redraw.connect(self.redraw)
-
-        self.fig = Figure()
-        self.ax = self.fig.add_subplot(111)
-
-        self.canvas = FigureCanvas(self.fig)
-        self.canvas.setParent(self)
+            properties = dict(properties)
+            container.set_label(properties.pop('label', None))
+            for patch, left, size, base in zip(container, self.ax.convert_xunits(x), height, bottom):
+                patch.set_bounds(left - width / 2, base, width, size)
+                patch.update(properties)
+        self.rescale()
+
+    def resolution(self):
+        return max(int(self.ax.bbox.width), 1)
+
+    def refine(self):
+        """Redoes the downsampling of the lines for the part now in view"""
+        if not self.lines:
+            return
+        import matplotlib.dates
+        from postings import downsample, to_datetime64
+
+        begin, end = (matplotlib.dates.num2date(x).toordinal() for x in self.ax.get_xlim())
+        for key, line in self.lines.items():
+            dates, values = self.full[key]
+            shown = downsample(dates, values, self.resolution(), begin, end + 1)
+            line.set_data(to_datetime64(dates[shown]), values[shown])
+        self.schedule_draw()
+
+    def rescale(self):
+        self.ax.relim(visible_only=True)
+        self.ax.autoscale_view()
+
+    def legend(self, keys):
+        """Legend listing the visible lines in the order of keys"""
+        handles = [self.lines[key] for key in keys
+                   if key in self.lines and self.lines[key].get_visible()]
+        legend = self.ax.get_legend()
+        if legend:
+            legend.remove()
+        if handles:
+            self.ax.legend(handles=handles, loc='upper left')
+
+class GraphTab(PlotTab):
+    DATASETS = ("time_series",)
 
-        self.mpl_toolbar = NavigationToolbar(self.canvas, self)
-        self.cmap = colormaps['gist_ncar']
+    def __init__(self, options):
+        super(GraphTab, self).__init__(options)
 
-        graphLayout = QVBoxLayout()
-        graphLayout.addWidget(self.canvas)
-        graphLayout.addWidget(self.mpl_toolbar)
+        self.commodities = CommodityBox(options)
+        self.commodities.changed.connect(self.redraw)
 
         layout = QHBoxLayout(self)
-        layout.addLayout(graphLayout)
+        layout.addWidget(self.commodities)
+        layout.addLayout(self.graphLayout)
 
-        self.series = None
-        self.commodity = None
+        # (running_total, total) of each source shown
+        self.results = None
+        self.order = []
 
+    @profiling.timed()
     def reset(self):
         options = self.options
-        self.commodity = options.show_currency.currentText()
-        self.merge = bool(self.commodity and options.merge.isChecked())
+        self.commodity = options.state.commodity
+        self.merge = bool(self.commodity and options.state.merge)
+
+        filter, sources, effective = options.state.filter, self.sources(), options.state.effective
+        journal, commodity, merge = options.journal, self.commodity, self.merge
+        # what ledger has so far is only shown for the one series
+        options.worker.submit(self,
+                lambda job: [journal.time_series(filter, commodity, merge, job.progress,
+                                                 job.snapshot if len(sources) == 1 else None,
+                                                 source, effective)
+                             for source in sources],
+                self.computed, self.failed, "Computing time series",
+                partial=lambda result: self.computed([result]))
+
+    @profiling.timed()
+    def computed(self, results):
+        self.results = results
+        self.replot()
+
+    def replot(self):
+        if self.fig is None or self.results is None:
+            return
+        import render
 
-        filter = options.filter.text()
-        self.series = options.journal.account_series(filter)
+        journal = self.options.journal
+        lines = render.overlay(journal.sources, [
+                render.time_series_lines(journal, running_total, total, self.commodity)
+                for running_total, total in self.results])
+        self.order = [line[0] for line in lines]
 
+        self.plot_lines(lines)
+        self.ax.set_ylabel(self.commodity or "")
         self.redraw()
 
+    @profiling.timed()
     def redraw(self):
-        self.ax.clear()
-        self.ax.grid(True)
-        if not self.series or not self.commodity:
+        if self.fig is None:
             return
+        for key, line in self.lines.items():
+            # overlaid lines are keyed by (source, commodity)
+            line.set_visible((key[1] if isinstance(key, tuple) else key) in self.commodities)
+        self.rescale()
+        self.legend(self.order)
+        self.schedule_draw()
 
-        def useable_accounts(limit):
-            aggregate = {}
+class AccountTab(PlotTab):
+    DATASETS = ("running", "aggregated", "postings")
 
-            for name in self.series.running_total:
-                account = self.series.accounts[name]
-
-                if limit and account.depth >= limit:
-                    while account.depth > limit:
-                        account = account.parent
-                    name = account.fullname()
-
-                    aggregate[name] = (get_value(self.series.aggregated_total[name], commodity),
-                                       self.series.aggregated_running[name])
-                elif name not in aggregate:
-                    aggregate[name] = (get_value(self.series.total[name], commodity),
-                                       self.series.running_total[name])
+    def __init__(self, options):
+        super(AccountTab, self).__init__(options)
 
-            accounts = len(aggregate)
-            colors = map(self.cmap, ((x+0.5)/accounts for x in range(accounts)))
+        layout = QHBoxLayout(self)
+        layout.addLayout(self.graphLayout)
 
-            return ((name, next(colors), aggregate[name]) for name in
-                sorted(aggregate, key=lambda x: aggregate[x][0], reverse=True))
+        self.series = None
+        self.commodity = None
 
-        commodity = self.options.journal.commodities[self.commodity]
-        limit = self.options.depth_limit.value()
-        for name, color, (total, running_total) in useable_accounts(limit):
-            label = ("%s (%s)") % (name, total)
-            running_total = {date: get_value(amount, commodity, date) for (date, amount) in running_total.items()}
-            x, y = zip(*sorted(running_total.items()))
-            self.ax.plot_date(x, y, fmt='o-', label=label, color=color)
+    @profiling.timed()
+    def reset(self):
+        options = self.options
+        filter, sources, effective = options.state.filter, self.sources(), options.state.effective
+        journal, commodity = options.journal, options.state.commodity
+        # valued in the commodity they come with, the rates (or from a server,
+        # the values) are there by then
+        options.worker.submit(self,
+                lambda job: [journal.account_series(filter, job.progress,
+                                                    job.snapshot if len(sources) == 1 else None,
+                                                    source, effective, commodity
+                                                    ).prefetch(commodity, (True,))
+                             for source in sources],
+                lambda series: self.computed(series, commodity),
+                self.failed, "Computing account series",
+                partial=lambda series: self.computed([series], commodity))
+
+    @profiling.timed()
+    def computed(self, series, commodity):
+        # of each source shown
+        self.series = series
+        self.commodity = commodity
+        self.redraw()
 
-        self.ax.set_ylabel(self.commodity)
-        self.ax.legend(loc='upper left')
-        self.fig.canvas.draw()
+    @profiling.timed()
+    def redraw(self):
+        if self.fig is None or self.series is None:
+            return
+        import render
 
-class BarTab(QWidget):
-    def __init__(self, options):
-        super(BarTab, self).__init__()
-        self.options = options
-        self.options.reset.connect(self.reset)
-        self.options.redraw.connect(self.redraw)
+        journal, limit = self.options.journal, self.options.state.depth
+        lines = render.overlay(journal.sources, [
+                render.account_lines(journal, series, limit, self.commodity)
+                for series in self.series])
 
-        self.classifiers = self.monthly
+        self.plot_lines(lines)
+        self.ax.set_ylabel(self.commodity or "")
+        self.legend([line[0] for line in lines])
+        self.schedule_draw()
 
-        self.fig = Figure()
-        self.ax = self.fig.add_subplot(111)
+class BarTab(PlotTab):
+    DATASETS = ("bars",)
+    PERIODS = ("day", "week", "month", "quarter", "year")
+    MONTHS = ("January", "February", "March", "April", "May", "June", "July",
+              "August", "September", "October", "November", "December")
 
-        self.canvas = FigureCanvas(self.fig)
-        self.canvas.setParent(self)
+    def __init__(self, options):
+        super(BarTab, self).__init__(options)
 
-        self.mpl_toolbar = NavigationToolbar(self.canvas, self)
-        self.cmap = colormaps['gist_ncar']
+        self.period = QComboBox()
+        self.period.addItems(self.PERIODS)
+        self.period.setCurrentText("month")
+        self.period.currentIndexChanged.connect(lambda index: self.redraw())
 
-        graphLayout = QVBoxLayout()
-        graphLayout.addWidget(self.canvas)
-        graphLayout.addWidget(self.mpl_toolbar)
+        # for fiscal quarters and years
+        self.first_month = QComboBox()
+        self.first_month.addItems(self.MONTHS)
+        self.first_month.currentIndexChanged.connect(lambda index: self.redraw())
 
-        #optionLayout = QVBoxLayout(self)
-        #optionLayout.addWidget(self.classifiers)
+        optionLayout = QHBoxLayout()
+        optionLayout.addWidget(QLabel("Sum up by"))
+        optionLayout.addWidget(self.period)
+        optionLayout.addWidget(QLabel("Year starts in"))
+        optionLayout.addWidget(self.first_month)
+        optionLayout.addStretch()
 
-        layout = QHBoxLayout(self)
-        layout.addLayout(graphLayout)
+        layout = QVBoxLayout(self)
+        layout.addLayout(optionLayout)
+        layout.addLayout(self.graphLayout)
 
         self.series = None
         self.commodity = None
 
-    def monthly(self, name, date, amount, to_commodity):
-        return (date.replace(day=1), name, get_value(amount, to_commodity, date))
-
+    @profiling.timed()
     def reset(self):
         options = self.options
-        self.commodity = options.show_currency.currentText()
-        self.merge = bool(self.commodity and options.merge.isChecked())
-
-        filter = options.filter.text()
-        self.series = options.journal.account_series(filter)
-
+        filter, effective = options.state.filter, options.state.effective
+        journal, commodity = options.journal, options.state.commodity
+        options.worker.submit(self,
+                lambda job: journal.account_series(filter, job.progress, job.snapshot,
+                                                   effective=effective, commodity=commodity
+                                                   ).prefetch(commodity, (False,)),
+                lambda series: self.computed(series, commodity),
+                self.failed, "Computing account series",
+                partial=lambda series: self.computed(series, commodity))
+
+    @profiling.timed()
+    def computed(self, series, commodity):
+        self.series = series
+        self.commodity = commodity
         self.redraw()
 
+    @profiling.timed()
     def redraw(self):
-        self.ax.clear()
-        self.ax.grid(True)
-        if not self.series or not self.commodity:
+        if self.fig is None:
             return
+        import render
 
-        accounts = {}
-        accounts_sorted = []
-        data = defaultdict(dict)
-        commodity = self.options.journal.commodities[self.commodity]
-        classifier = self.classifiers
-        limit = self.options.depth_limit.value()
-        width = timedelta(10)
-
-        Balance = self.options.journal.ledger.Balance
-        Amount = self.options.journal.ledger.Amount
-
-        def useable_accounts(series, commodity, limit):
-            aggregate = {}
-
-            for name in series.running_total:
-                account = series.accounts[name]
-
-                if limit and account.depth >= limit:
-                    while account.depth > limit:
-                        account = account.parent
-                    name = account.fullname()
-
-                    aggregate[name] = (get_value(series.aggregated_total[name], commodity),
-                                       series.aggregated_postings[name])
-                elif name not in aggregate:
-                    aggregate[name] = (get_value(series.total[name], commodity),
-                                       series.postings[name])
-
-            accounts = len(aggregate)
-
-            return ((name, aggregate[name]) for name in
-                sorted(aggregate, key=lambda x: aggregate[x][0], reverse=True))
-
-        for name, (total, postings) in useable_accounts(self.series, commodity, limit):
-            label = ("%s (%s)") % (name, total)
-            accounts_sorted.append(label)
-            number = accounts[name] = (len(accounts), label)
-            for group, bucket, value in (
-                    classifier(accounts[name], date, amount, commodity)
-                        for (date, amount) in postings.items()):
-                data[group][bucket] = data[group].get(bucket, Balance()) + value
-            postings = {date: get_value(amount, commodity, date)
-                    for (date, amount) in postings.items()}
-
-        view = defaultdict(dict)
-        for group, buckets in data.items():
-            offsets = [Balance(), Balance()]
-            sum_neg = Balance()
-            for account in sorted(accounts.values()):
-                if account not in buckets:
-                    continue
-                value = buckets[account]
-                value = value and value.to_amount() or Amount(0)
-                negative = int(value < 0)
-
-                offset = offsets[negative]
-                view[account][group] = [negative, offset, value]
-                offsets[negative] = offset + value
-                if negative:
-                    sum_neg += value
-
-            for account, l in view.items():
-                if group not in l:
-                    continue
-                value = l[group]
-                if value[0]:
-                    new = value[1] + value[2] - sum_neg
-                    value[2].in_place_negate()
-                else:
-                    new = value[1]
-                value[1] = new and float(new.to_amount().number()) or 0
-                value[2] = float(value[2].number())
-
-        horizontal_offsets = [ -width/2, width/2 ]
-
-        for key, data in view.items():
-            index, label = key
-            label = accounts_sorted[index]
-            color = self.cmap((index+0.5)/len(accounts_sorted))
-            bars = [defaultdict(list), defaultdict(list)]
-            for group in sorted(data.keys()):
-                negative, offset, height = data[group]
-                bars[negative]['group'].append(group+horizontal_offsets[negative])
-                bars[negative]['offset'].append(offset)
-                bars[negative]['height'].append(height)
-            self.ax.bar(bars[0]['group'], bars[0]['height'], width.days,
-                bottom=bars[0]['offset'], color=color, label=label)
-            self.ax.bar(bars[1]['group'], bars[1]['height'], width.days,
-                bottom=bars[1]['offset'], color=color)
-
-        self.ax.set_ylabel(self.commodity)
-        #self.ax.legend(loc='upper left')
-        self.fig.canvas.draw()
-
+        period = self.period.currentText()
+        self.first_month.setEnabled(period in ("quarter", "year"))
+        limit = self.options.state.depth
+        bars = render.bars(self.options.journal, self.series, limit, self.commodity,
+                           period, self.first_month.currentIndex() + 1)
 
-class PieTab(QWidget):
-    def __init__(self, options):
-        super(PieTab, self).__init__()
-        self.options = options
-        self.options.reset.connect(self.reset)
-        self.options.redraw.connect(self.redraw)
+        self.plot_bars(bars, render.bar_width(period))
+        self.ax.set_ylabel(self.commodity or "")
+        #self.ax.legend(loc='upper left')
+        self.schedule_draw()
 
-        self.fig, self.ax = subplots()
+    def export_settings(self):
+        return dict(super(BarTab, self).export_settings(), period=self.period.currentText(),
+                    first_month=self.first_month.currentIndex() + 1)
 
-        self.canvas = FigureCanvas(self.fig)
-        self.canvas.setParent(self)
+class PieTab(PlotTab):
+    DATASETS = ("running", "aggregated", "postings")
 
-        self.mpl_toolbar = NavigationToolbar(self.canvas, self)
-        self.cmap = colormaps['gist_ncar']
+    def __init__(self, options):
+        super(PieTab, self).__init__(options)
 
+        # only show this account and those below it
         self.account = QLineEdit(self)
+        self.account.setPlaceholderText("All accounts")
+        self.account.setClearButtonEnabled(True)
         self.account.editingFinished.connect(self.redraw)
+        self.account.setCompleter(QCompleter(self.account))
+        self.account.completer().setCaseSensitivity(Qt.CaseInsensitive)
 
-        graphLayout = QVBoxLayout(self)
-        graphLayout.addWidget(self.account)
-        graphLayout.addWidget(self.canvas)
-        graphLayout.addWidget(self.mpl_toolbar)
+        layout = QVBoxLayout(self)
+        layout.addWidget(self.account)
+        layout.addLayout(self.graphLayout)
 
         self.series = None
         self.commodity = None
 
+    @profiling.timed()
     def reset(self):
         options = self.options
-        self.commodity = options.show_currency.currentText()
-        if not self.commodity:
+        commodity = options.state.commodity
+        if not commodity:
+            # nothing to show, nothing to value
+            self.commodity = commodity
+            options.worker.cancel(self)
             return
 
-        filter = options.filter.text()
-        self.series = options.journal.account_series(filter)
-
+        filter, effective = options.state.filter, options.state.effective
+        journal = options.journal
+        options.worker.submit(self,
+                lambda job: journal.account_series(filter, job.progress, job.snapshot,
+                                                   effective=effective, commodity=commodity
+                                                   ).prefetch(commodity, totals=True),
+                lambda series: self.computed(series, commodity),
+                self.failed, "Computing account series",
+                partial=lambda series: self.computed(series, commodity))
+
+    @profiling.timed()
+    def computed(self, series, commodity):
+        self.series = series
+        self.commodity = commodity
+        self.account.completer().setModel(QStringListModel(series.names[1:], self))
         self.redraw()
 
-    def wedges(self, values, threshold=0.01):
-        """Generates wedges as long as the new one would be
-           at least (threshold * current total), then one more
-           for the rest of the data"""
-        out = []
-        total = 0
-        while values:
-            current = values[0]
-            value, name = current
-            if total and float(value / total) < threshold and len(values) > 1:
-                remainder = sum((x[0] for x in values))
-                current = (remainder, 'long tail of {} below {:.2%}'.format(len(values), threshold))
-                out.append(current)
-                total += remainder
-                break
-            else:
-                out.append(current)
-                total += value
-                values.pop(0)
-
-        if total:
-            out = [(value.abs(), "{} ({:.2%})".format(name, float(value / total))) for (value, name) in out]
-
-        # the graph gets drawn counter-clockwise, reverse to get it clockwise
-        return zip(*reversed(out))
-
+    @profiling.timed()
     def redraw(self):
-        self.ax.clear()
-        if not self.series or not self.commodity:
+        if self.fig is None:
             return
+        import render
 
-        commodity = self.options.journal.commodities[self.commodity]
-
-        data = []
-        processed = set()
-        for name, account in self.series.accounts.items():
-            limit = self.options.depth_limit.value()
-            aggregate = limit and account.depth >= limit
-
-            if aggregate:
-                while account.depth > limit:
-                    account = account.parent
-
-                name = account.fullname()
-                value = self.series.aggregated_total[name]
-            else:
-                value = self.series.total[name]
-
-            if name in processed:
-                continue
+        self.ax.clear()
+        self.schedule_draw()
+
+        limit = self.options.state.depth
+        wedges = render.pie(self.series, limit, self.commodity, self.account.text().strip())
+        if wedges:
+            sizes, labels, colors = wedges
+            self.ax.pie(sizes, labels=labels, colors=colors, startangle=90)
+
+class ProfilePanel(QGroupBox):
+    """The last timings of what the application has been doing, while
+       profiling is on"""
+    def __init__(self, title="Profiling"):
+        super(ProfilePanel, self).__init__(title)
+        self.setCheckable(True)
+        self.setChecked(profiling.enabled)
+        self.toggled.connect(self.toggle)
 
-            data.append((get_value(value, commodity), name))
-            processed.add(name)
+        self.timings = QLabel()
+        self.timings.setTextInteractionFlags(Qt.TextSelectableByMouse)
+        font = self.timings.font()
+        font.setFamily("monospace")
+        self.timings.setFont(font)
 
-        if not data:
-            return
+        clear = QPushButton("Clear")
+        clear.clicked.connect(self.clear)
+        export = QPushButton("Export trace...")
+        export.clicked.connect(self.export)
 
-        data = sorted(data, reverse=True, key=lambda x: x[0].abs())
+        buttons = QHBoxLayout()
+        buttons.addStretch()
+        buttons.addWidget(clear)
+        buttons.addWidget(export)
 
-        sizes, labels = self.wedges(data)
-        colors = map(self.cmap, (1 - float(x)/len(sizes) for x in range(len(sizes))))
-        self.ax.pie(sizes, labels=labels, colors=list(colors), startangle=90)
-        self.fig.canvas.draw()
+        layout = QVBoxLayout(self)
+        layout.addWidget(self.timings)
+        layout.addLayout(buttons)
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(PROFILE_INTERVAL)
+        self.timer.timeout.connect(self.show_timings)
+        self.toggle(profiling.enabled)
+
+    def toggle(self, on):
+        profiling.enable(on)
+        self.timings.setVisible(on)
+        if on:
+            self.timer.start()
+        else:
+            self.timer.stop()
+
+    def show_timings(self):
+        lines = ["{:40} {:>6} {:>10} {:>10}  {}".format("", "calls", "last ms", "total ms", "counts")]
+        for name, (calls, total, last, counts) in sorted(profiling.summary().items()):
+            counts = " ".join("{}={}".format(key, value) for key, value in sorted(counts.items()))
+            lines.append("{:40} {:>6} {:>10.1f} {:>10.1f}  {}".format(
+                name[:40], calls, last / 1e6, total / 1e6, counts))
+        self.timings.setText("\n".join(lines))
+
+    def clear(self):
+        profiling.spans.clear()
+        self.show_timings()
+
+    def export(self):
+        filename, _ = QFileDialog.getSaveFileName(self, "Save trace", "trace.json",
+                                                  "Chrome trace (*.json)")
+        if filename:
+            profiling.export(filename)
 
 class Window(QWidget):
-    def __init__(self):
+    def __init__(self, filenames=None):
         super(Window, self).__init__()
         self.setWindowTitle("Ledger visualizer")
 
         # Create a layout Object, attached to the window.
         layout = QVBoxLayout(self)
 
-        self.options = Options(self)
+        self.options = Options(self, filenames)
         layout.addWidget(self.options)
 
         tabs = QTabWidget()
         layout.addWidget(tabs)
+        self.options.export.clicked.connect(lambda: tabs.currentWidget().export())
 
         graph = GraphTab(self.options)
         tabs.addTab(graph, "Time series")
@@ -560,15 +901,25 @@ class Window(QWidget):
         text = PieTab(self.options)
         tabs.addTab(text, "Pie charts")
 
+        layout.addWidget(ProfilePanel())
+
         button = QPushButton("Quit", self)
         layout.addWidget(button)
 
-        button.clicked.connect(app.quit)
+        button.clicked.connect(QApplication.instance().quit)
+
+    def shown(self):
+        """Reports how long it took from starting up to the window being up"""
+        elapsed = time.perf_counter_ns() - STARTED
+        profiling.record("startup", STARTED, elapsed)
+        self.options.status.setText("Window up in {:.0f} ms".format(elapsed / 1e6))
 
 if __name__=='__main__':
     app = QApplication(sys.argv[1:])
 
-    window = Window()
+    arguments = app.arguments()
+    window = Window(arguments)
     window.show()
+    QTimer.singleShot(0, window.shown)
 
     sys.exit(app.exec_())
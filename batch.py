@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""Renders the plots the visualizer shows to image files without a display,
+for a batch of journals, filters, commodities and depths at a time.
+
+Jobs are given either on the command line (every journal gets the same plot)
+or as a file with one JSON object per line, for example:
+
+    {"file": "main.ledger", "kind": "accounts", "filter": "Expenses",
+     "commodity": "EUR", "depth": 2, "output": "expenses.svg"}
+
+Missing keys default to the command line options."""
+import argparse
+import json
+import os
+import re
+import sys
+from multiprocessing import Pool
+
+import matplotlib
+matplotlib.use("Agg")
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+import render
+from postings import PERIODS
+
+# the journals loaded by this worker process, each is only parsed once
+journals = {}
+
+def journal(filename, effective_date):
+    from datasource import Journal
+
+    key = (os.path.abspath(filename), effective_date)
+    if key not in journals:
+        journals[key] = Journal(filename, effective_date=effective_date)
+    return journals[key]
+
+def output_name(job, index):
+    stem = os.path.splitext(os.path.basename(job["file"]))[0]
+    parts = [stem, str(index), job["kind"], job["commodity"], job["filter"]]
+    if job["depth"]:
+        parts.append("depth{}".format(job["depth"]))
+    name = "-".join(re.sub(r"[^\w.]+", "_", part) for part in parts if part)
+    return os.path.join(job["directory"], "{}.{}".format(name, job["format"]))
+
+def run(job):
+    """Renders one job, returns (output, error)"""
+    try:
+        fig = Figure(figsize=job["size"])
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot(111)
+        render.draw(ax, journal(job["file"], job["effective"]), job["kind"],
+                    job["filter"], job["commodity"], job["depth"], job["merge"],
+                    job["period"], job["first_month"])
+        fig.savefig(job["output"])
+    except Exception as e:
+        return job["output"], "{}: {}".format(type(e).__name__, e)
+    return job["output"], None
+
+def jobs(args):
+    defaults = {
+        "kind": args.kind,
+        "filter": args.filter,
+        "commodity": args.commodity,
+        "depth": args.depth,
+        "merge": args.merge,
+        "period": args.period,
+        "first_month": args.first_month,
+        "effective": args.effective,
+        "format": args.format,
+        "directory": args.output_dir,
+        "size": args.size,
+    }
+    specs = [dict(file=filename) for filename in args.journals]
+    if args.jobs:
+        with open(args.jobs) if args.jobs != "-" else sys.stdin as f:
+            specs.extend(json.loads(line) for line in f if line.strip())
+
+    for index, spec in enumerate(specs):
+        job = dict(defaults, **spec)
+        if job["kind"] not in render.KINDS:
+            raise SystemExit("Unknown kind of plot: {}".format(job["kind"]))
+        job.setdefault("output", output_name(job, index))
+        yield job
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render ledger plots to files")
+    parser.add_argument("journals", nargs="*", help="journals to render with the options below")
+    parser.add_argument("--jobs", help="file with one JSON job per line, - for stdin")
+    parser.add_argument("--kind", choices=render.KINDS, default="time_series")
+    parser.add_argument("--filter", default="", help="ledger query to restrict postings to")
+    parser.add_argument("--commodity", default="", help="show values in terms of this commodity")
+    parser.add_argument("--depth", type=int, default=0, help="account depth to show, 0 for unlimited")
+    parser.add_argument("--merge", action="store_true", help="merge commodities into one line")
+    parser.add_argument("--period", choices=sorted(PERIODS), default="month",
+                        help="what the bars sum up by")
+    parser.add_argument("--first-month", type=int, choices=range(1, 13), default=1, metavar="MONTH",
+                        help="month (fiscal) quarters and years start in")
+    parser.add_argument("--effective", action="store_true", help="use effective dates")
+    parser.add_argument("--format", choices=("png", "svg"), default="png")
+    parser.add_argument("--output-dir", default=".")
+    parser.add_argument("--size", type=float, nargs=2, default=(12, 8), metavar=("WIDTH", "HEIGHT"),
+                        help="figure size in inches")
+    parser.add_argument("--processes", type=int, default=None, help="defaults to the number of CPUs")
+    args = parser.parse_args(argv)
+
+    # keep the jobs for a journal together so fewer workers need to load it
+    batch = sorted(jobs(args), key=lambda job: (job["file"], job["effective"]))
+    if not batch:
+        parser.error("nothing to render, give journals or --jobs")
+
+    failed = 0
+    with Pool(args.processes) as pool:
+        for output, error in pool.imap_unordered(run, batch):
+            if error:
+                failed += 1
+                print("{}: {}".format(output, error), file=sys.stderr)
+            else:
+                print(output)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""Times the data and render paths on synthetic journals (see synthetic.py)
+and reports the results as JSON, optionally compared against an earlier run.
+
+Each scenario runs in a fresh process, ledger only has the one session and
+the peak memory is then that scenario's own."""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import synthetic
+
+SCENARIOS = {
+    "small": dict(postings=10000),
+    "large": dict(postings=200000, years=20),
+    "deep": dict(postings=50000, depth=6, breadth=3),
+    "wide": dict(postings=50000, depth=2, breadth=200),
+    "commodities": dict(postings=50000, commodities=30),
+    "prices": dict(postings=50000, commodities=5, prices_per_year=365),
+}
+
+FILTERS = ["Expenses", "Assets and not payee 'Payee 1'", "%tag1"]
+
+@contextmanager
+def environment(directory):
+    """Points the on-disk cache somewhere it does not get in the way"""
+    previous = os.environ.get("XDG_CACHE_HOME")
+    os.environ["XDG_CACHE_HOME"] = directory
+    try:
+        yield
+    finally:
+        if previous is None:
+            del os.environ["XDG_CACHE_HOME"]
+        else:
+            os.environ["XDG_CACHE_HOME"] = previous
+
+def measure(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return {"min": min(times), "median": statistics.median(times)}
+
+def scenario(parameters, repeat, trace_memory=False, threads=1):
+    """Runs the stages on a journal generated from parameters, returns
+       {"timings": {stage: {"min", "median"}}, "memory": {...}}. Tracing
+       Python's allocations slows everything down, so it is optional."""
+    import matplotlib
+    matplotlib.use("Agg")
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    from datasource import Journal
+    from valuation import Valuation
+    import postings
+    import render
+
+    postings.parallel(threads)
+    with tempfile.TemporaryDirectory() as directory, environment(directory):
+        filename = os.path.join(directory, "journal.ledger")
+        with open(filename, "w") as out:
+            synthetic.generate(out, **parameters)
+        commodity = synthetic.BASE
+        timings = {}
+
+        if trace_memory:
+            tracemalloc.start()
+        timings["parse"] = measure(lambda: Journal(filename, use_cache=False), repeat)
+        journal = Journal(filename)
+        timings["cached_load"] = measure(lambda: Journal(filename), repeat)
+
+        def queries():
+            journal.cache.clear()
+            for filter in FILTERS:
+                journal.postings(filter)
+        timings["query"] = measure(queries, repeat)
+        timings["ledger_query"] = measure(
+                lambda: journal.filtered(journal.postings(), "expr 'amount > 500'"), repeat)
+
+        def time_series():
+            journal.cache.clear()
+            journal.time_series("")
+        def account_series():
+            journal.cache.clear()
+            journal.account_series("")
+        timings["time_series"] = measure(time_series, repeat)
+        timings["account_series"] = measure(account_series, repeat)
+
+        def valuation(function):
+            def run():
+                journal.cache.clear()
+                journal.valuation = Valuation(journal)
+                function()
+            return run
+        series = journal.account_series("")
+        timings["time_series_valued"] = measure(
+                valuation(lambda: journal.time_series("", commodity, True)), repeat)
+        timings["accounts_valued"] = measure(
+                valuation(lambda: journal.account_series("").valued(0, commodity)), repeat)
+        timings["balance_value"] = measure(
+                lambda: [journal.valuation.value(balance, commodity)
+                         for balance in series.total.values()], repeat)
+
+        for kind in render.KINDS:
+            def draw():
+                fig = Figure(figsize=(12, 8))
+                FigureCanvasAgg(fig)
+                render.draw(fig.add_subplot(111), journal, kind, "", commodity, 2)
+                fig.savefig(io.BytesIO(), format="png")
+            timings["render_" + kind] = measure(draw, repeat)
+
+    # kilobytes on Linux, bytes on macOS
+    memory = {"max_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+    if trace_memory:
+        memory["python_peak"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {"timings": timings, "memory": memory}
+
+def run(names, repeat, extra=None, trace_memory=False, threads=1):
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    for name in names:
+        parameters = dict(SCENARIOS[name], **(extra or {}))
+        with context.Pool(1) as pool:
+            result = pool.apply(scenario, (parameters, repeat, trace_memory, threads))
+        results[name] = dict(result, parameters=parameters)
+        print("{}: done".format(name), file=sys.stderr)
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "repeat": repeat,
+        "trace_memory": trace_memory,
+        "threads": threads,
+        "scenarios": results,
+    }
+
+def compare(results, baseline, tolerance, noise):
+    """Prints how each timing changed against baseline, returns the number of
+       those that got slower by more than tolerance (and noise seconds)"""
+    slower = 0
+    for name, result in results["scenarios"].items():
+        before = baseline["scenarios"].get(name)
+        if not before or before["parameters"] != result["parameters"]:
+            continue
+        for stage, timing in result["timings"].items():
+            old = before["timings"].get(stage)
+            if not old:
+                continue
+            ratio = timing["min"] / old["min"] if old["min"] else float("inf")
+            flag = ""
+            if abs(timing["min"] - old["min"]) <= noise:
+                pass
+            elif ratio > 1 + tolerance:
+                flag = " SLOWER"
+                slower += 1
+            elif ratio < 1 - tolerance:
+                flag = " faster"
+            print("{:12} {:20} {:9.4f}s -> {:9.4f}s {:6.2f}x{}".format(
+                name, stage, old["min"], timing["min"], ratio, flag), file=sys.stderr)
+    return slower
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("scenarios", nargs="*",
+                        help="any of {}, defaults to all of them".format(", ".join(sorted(SCENARIOS))))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, help="overrides the scenarios' seed")
+    parser.add_argument("--output", help="file to write the results to, standard output otherwise")
+    parser.add_argument("--baseline", help="results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="how much slower a stage can get before it counts as a regression")
+    parser.add_argument("--noise", type=float, default=0.005,
+                        help="differences of up to this many seconds are not counted")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="also report Python's peak allocations, at the cost of slower timings")
+    parser.add_argument("--threads", type=int, default=1,
+                        help="threads to aggregate big tables with, 0 for one per core")
+    args = parser.parse_args(argv)
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error("unknown scenarios: " + ", ".join(sorted(unknown)))
+
+    extra = {"seed": args.seed} if args.seed is not None else None
+    results = run(args.scenarios or sorted(SCENARIOS), args.repeat, extra, args.trace_memory,
+                  args.threads or None)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance, args.noise):
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,200 @@
+import glob
+import hashlib
+import json
+import os
+import re
+import tempfile
+
+import numpy as np
+
+from postings import Accounts, Commodities, Names, PostingTable, Prices, exact
+
+# bump when what gets stored changes
+VERSION = 5
+
+INCLUDE = re.compile(r"^[!@]?include\s+(.+?)\s*$")
+
+def cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "visualise_ledger")
+
+def journal_files(filename, seen=None):
+    """The journal file followed by everything it includes, recursively"""
+    seen = seen if seen is not None else []
+    filename = os.path.abspath(filename)
+    if filename in seen:
+        return seen
+    seen.append(filename)
+
+    with open(filename, errors="replace") as f:
+        for line in f:
+            match = INCLUDE.match(line)
+            if not match:
+                continue
+            pattern = os.path.join(os.path.dirname(filename),
+                                   os.path.expanduser(match.group(1)))
+            for included in sorted(glob.glob(pattern)):
+                journal_files(included, seen)
+    return seen
+
+def fingerprint(filename):
+    files = journal_files(filename)
+    digest = hashlib.sha1()
+    stats = []
+    for name in files:
+        stat = os.stat(name)
+        contents = hashlib.sha1()
+        with open(name, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+                contents.update(block)
+        stats.append([name, stat.st_mtime_ns, stat.st_size, contents.hexdigest()])
+    return {"version": VERSION, "files": stats, "sha1": digest.hexdigest()}
+
+def changed(stamp):
+    """Whether the files a fingerprint was taken of look any different now,
+       without reading them"""
+    try:
+        for name, mtime, size, _ in stamp["files"]:
+            stat = os.stat(name)
+            if (stat.st_mtime_ns, stat.st_size) != (mtime, size):
+                return True
+    except OSError:
+        return True
+    return False
+
+def prefix_sha1(name, size):
+    digest = hashlib.sha1()
+    with open(name, "rb") as f:
+        while size > 0:
+            block = f.read(min(size, 1 << 20))
+            if not block:
+                break
+            digest.update(block)
+            size -= len(block)
+    return digest.hexdigest()
+
+def appended(old, new):
+    """Compares two fingerprints of the same journal, returns {file: (offset,
+       size)} of the files that were only added to at the end (offset is where
+       what was added starts), None if anything else changed"""
+    if [f[0] for f in old["files"]] != [f[0] for f in new["files"]]:
+        return None
+
+    offsets = {}
+    for (name, _, before, digest), (_, _, size, current) in zip(old["files"], new["files"]):
+        if current == digest:
+            continue
+        if size <= before or prefix_sha1(name, before) != digest:
+            return None
+        offsets[name] = (before, size)
+    return offsets
+
+def read_tail(name, offset, size):
+    """What is in the file between offset and size, None if it does not start
+       on a line of its own"""
+    with open(name, "rb") as f:
+        f.seek(max(offset - 1, 0))
+        data = f.read(size - offset + (1 if offset else 0))
+    if offset:
+        if data[:1] != b"\n":
+            return None
+        data = data[1:]
+    return data.decode(errors="replace")
+
+# lines a piece of journal can be parsed on its own with, besides the postings
+# of its transactions: transactions, prices, comments and blank lines
+STANDALONE = re.compile(r"^(?:\d|P\s|[;#*%|]|\s*$)")
+
+# what changes the meaning of the transactions after it: directives setting
+# account aliases and prefixes, the year, default commodity or account,
+# automated transactions, balance assignments (worked out from the balance
+# before them) and directives with sub-directives (an account's or payee's
+# aliases, the default account)
+CONTEXTUAL = re.compile(r"^(?:(?:alias|apply|year|bucket|[YDA])(?=[ \t\d]|$)|="
+                        r"|[ \t]+[^;\s][^;\n]*?(?:  |\t)[ \t]*="
+                        r"|[A-Za-z][^\n]*\n(?:[ \t]+;[^\n]*\n)*[ \t]+[^;\s])", re.MULTILINE)
+
+def standalone(text):
+    """Whether text parses the same without the journal it was appended to,
+       as far as can be told without ledger"""
+    lines = text.splitlines()
+    first = next((line for line in lines if line.strip()), "")
+    if first[:1].isspace():
+        # carries on with the last transaction before it
+        return False
+    return (all(line[:1].isspace() or STANDALONE.match(line) for line in lines)
+            and not CONTEXTUAL.search(text))
+
+def contextual(stamp):
+    """Whether the files a fingerprint was taken of have anything (see
+       CONTEXTUAL) that would have what is appended to them parse differently
+       on its own"""
+    for name, _, size, _ in stamp["files"]:
+        with open(name, "rb") as f:
+            text = f.read(size).decode(errors="replace")
+        if CONTEXTUAL.search(text):
+            return True
+    return False
+
+def cache_file(filename, effective):
+    key = hashlib.sha1(os.path.abspath(filename).encode()).hexdigest()
+    return os.path.join(cache_dir(), "{}{}.npz".format(key, "-effective" if effective else ""))
+
+def load(filename, effective, stamp):
+    """Returns (PostingTable, Prices, precisions) as saved for this journal if
+       neither it nor any of the files it includes have changed since, stamp
+       is its current fingerprint"""
+    try:
+        with np.load(cache_file(filename, effective)) as data:
+            meta = json.loads(str(data["meta"]))
+            if meta["fingerprint"] != stamp:
+                return None
+
+            accounts = Accounts(data["accounts"].tolist())
+            commodities = Commodities(data["commodities"].tolist(), data["decimals"].tolist())
+            quantity = data["quantity"]
+            if quantity.dtype.kind == "U":
+                quantity = exact([int(q) for q in quantity.tolist()])
+            table = PostingTable(data["date"], data["account"], data["commodity"],
+                                 quantity, accounts, commodities, meta["hints"],
+                                 data["payee"], data["tagged"], Names(data["names"].tolist()))
+            prices = Prices(data["price_source"], data["price_target"],
+                            data["price_date"], data["price_rate"])
+    except Exception:
+        # missing, truncated or otherwise broken, the journal gets parsed again
+        return None
+    return table, prices, meta["precisions"]
+
+def save(filename, effective, table, prices, precisions, stamp):
+    """Stores what was extracted from the journal, stamp is its fingerprint
+       from before it was parsed"""
+    meta = {
+        "fingerprint": stamp,
+        "hints": table.hints,
+        "precisions": precisions,
+    }
+    path = cache_file(filename, effective)
+    # too big for int64, as decimal strings rather than pickled
+    quantity = table.quantity.astype(str) if table.quantity.dtype == object else table.quantity
+    temporary = None
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # of its own, others may be saving the same journal at the same time
+        fd, temporary = tempfile.mkstemp(".npz", ".tmp-", os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, meta=json.dumps(meta),
+                     date=table.date, account=table.account,
+                     commodity=table.commodity, quantity=quantity,
+                     accounts=np.array(table.accounts.names, dtype=str),
+                     commodities=np.array(table.commodities.symbols, dtype=str),
+                     decimals=np.array(table.commodities.decimals, dtype=np.int32),
+                     payee=table.payee, tagged=table.tagged,
+                     names=np.array(table.names.names, dtype=str),
+                     price_source=prices.source, price_target=prices.target,
+                     price_date=prices.date, price_rate=prices.rate)
+        os.replace(temporary, path)
+    except OSError:
+        # not being able to cache is not fatal
+        if temporary and os.path.exists(temporary):
+            os.remove(temporary)
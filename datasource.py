@@ -1,29 +1,165 @@
+import multiprocessing
+import os
 import sys
-from collections import defaultdict
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from collections.abc import Mapping
+from datetime import date
+from decimal import Decimal
 import ledger
+import numpy as np
+
+import cache
+import profiling
+import query
+from postings import PostingTable, Prices, groups, merge
+from valuation import Valuation
+
+# ledger has a single session, only let one thread use it at a time
+lock = threading.RLock()
 
 def debug():
     from PyQt5.QtCore import pyqtRemoveInputHook; pyqtRemoveInputHook()
     import ipdb; ipdb.set_trace()
 
-def get_value(amount, commodity, *maybe_date):
-    # there is an optional parameter, date
-    value = amount.value(commodity, *maybe_date)
-    # for zero balance, to_amount() will throw an ArithmeticError
-    return value and value.to_amount() or ledger.Amount(0)
+def file_identity(filename):
+    stat = os.stat(filename)
+    return (os.path.abspath(filename), stat.st_mtime_ns, stat.st_size)
+
+def price_history(pool, commodities):
+    """Adds the commodities only used in prices (they can still be shown in
+       terms of) and returns the display precisions and price history"""
+    for symbol in pool.keys():
+        commodities.add(symbol)
+    precisions = {symbol: pool.find(symbol).precision
+                  for symbol in commodities.symbols if pool.find(symbol)}
+    return precisions, Prices.from_pool(pool, commodities)
+
+def parse_piece(text, effective_dates):
+    """What Journal.extract gets from a journal, for a piece of one, as
+       ({effective: PostingTable}, Prices, precisions). Replaces ledger's
+       session, so it is run in a process of its own."""
+    journal = ledger.read_journal_from_string(text)
+    tables, table = {}, None
+    for effective in effective_dates:
+        options = "--sort d --effective" if effective else "--sort d"
+        table = tables[effective] = PostingTable.from_posts(journal.query(options), table)
+
+    precisions, prices = price_history(ledger.commodities, table.commodities)
+    return tables, prices, precisions
+
+def parse_elsewhere(text, effective_dates):
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(1, mp_context=context) as executor:
+        return executor.submit(parse_piece, text, effective_dates).result()
+
+def elsewhere(function, calls):
+    """Runs function(*arguments) for each of calls in processes of their own
+       at the same time, yielding (position in calls, result) as they finish"""
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(len(calls), mp_context=context) as executor:
+        futures = {executor.submit(function, *arguments): i for i, arguments in enumerate(calls)}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+def extract_file(filename, effective, use_cache=True):
+    """What Journal.extract gets from a journal file, as (PostingTable,
+       Prices, precisions, fingerprint, whether ledger parsed it). Replaces
+       ledger's session, so it is run in a process of its own."""
+    journal = Journal(filename, effective_date=effective, use_cache=use_cache)
+    return journal.postings(), journal.prices, journal.precisions, journal.stamp, journal.cold
+
+def query_file(filename, filter, effective):
+    """The postings ledger finds for filter in a journal file, the same way"""
+    journal = Journal(filename, effective_date=effective)
+    return PostingTable.from_posts(journal.entries(filter))
+
+class TimeSeries:
+    """Running totals per commodity of a posting table, as returned by
+       PostingTable.time_series. Their value in another commodity is worked
+       out for all of them at once the first time it is asked for and kept
+       for the next time."""
+    def __init__(self, journal, table):
+        self.source = journal
+        self.table = table
+        self.derived = {}
+
+    def prepare(self):
+        self.running_total, self.total = self.table.time_series()
+        self.derived.clear()
+        return self
+
+    def extended(self, table):
+        """A new TimeSeries with the postings of a table sharing the side
+           tables of this one added, this one may still be in use"""
+        return TimeSeries(self.source, self.table.extend(table)).prepare()
+
+    @profiling.timed()
+    def valued(self, commodity, merge=False):
+        """(running_total, total) valued in commodity at the latest rates,
+           merged into a single series named commodity if asked to"""
+        key = (commodity, merge)
+        if key in self.derived:
+            return self.derived[key]
+
+        valuation = self.source.valuation
+        rates = {symbol: valuation.timeline(symbol, commodity)[2] for symbol in self.total}
+        if not merge:
+            running_total = {symbol: (dates, totals * rates[symbol])
+                             for symbol, (dates, totals) in self.running_total.items()}
+            total = {symbol: totals[-1] for symbol, (_, totals) in running_total.items()}
+        elif self.running_total:
+            days = np.unique(np.concatenate([dates for dates, _ in self.running_total.values()]))
+            values = np.zeros(len(days))
+            for symbol, (dates, totals) in self.running_total.items():
+                # carry each total over to the days it did not change
+                i = np.searchsorted(dates, days, side="right") - 1
+                values += np.where(i >= 0, totals[np.maximum(i, 0)], 0) * rates[symbol]
+            running_total, total = {commodity: (days, values)}, {commodity: values[-1]}
+        else:
+            running_total, total = {}, {}
+
+        self.derived[key] = running_total, total
+        return self.derived[key]
 
 class StatefulAccounts:
-    def __init__(self, journal):
-        self.journal = journal.journal
-        self.commodities = set()
+    """Per account running totals. Only the postings are stored (as the deltas
+       in a PostingTable), the running, aggregated and per date totals are
+       worked out from them the first time they are asked for."""
+    def __init__(self, journal, table=None):
+        self.source = journal
+        self.table = table if table is not None else journal.postings().select(slice(0))
+        # the one valuation the rates come from, see prepare_valuation
+        self.valuation = journal.valuation
+        self.pending = []
+        self.derived = {}
+
+        self.running_total = AccountView(self, "running")
+        self.total = AccountView(self, "total")
+        self.postings = AccountView(self, "postings")
+
+        self.aggregated_running = AccountView(self, "running", aggregated=True)
+        self.aggregated_total = AccountView(self, "total", aggregated=True)
+        self.aggregated_postings = AccountView(self, "postings", aggregated=True)
+
+    @property
+    def journal(self):
+        return self.source.journal
 
-        self.postings = defaultdict(lambda: defaultdict(ledger.Balance))
-        self.running_total = defaultdict(dict)
-        self.total = defaultdict(ledger.Balance)
+    @property
+    def deltas(self):
+        if self.pending:
+            posts, self.pending = self.pending, []
+            table = self.table
+            self.table = table.extend(PostingTable.from_posts(posts, table))
+            self.derived.clear()
+        return self.table
 
-        self.aggregated_postings = defaultdict(lambda: defaultdict(ledger.Balance))
-        self.aggregated_running = defaultdict(dict)
-        self.aggregated_total = defaultdict(ledger.Balance)
+    @property
+    def commodities(self):
+        table = self.deltas
+        return {table.commodities.symbols[id] for id in np.unique(table.commodity)}
 
     @property
     def accounts(self):
@@ -36,87 +172,582 @@ class StatefulAccounts:
     def account_hierarchy(self):
         pass
 
-    def _aggregate(self, post, account):
-        name = account.fullname()
-        total = self.aggregated_total[name]
-        series = self.aggregated_running[name]
-        postings = self.aggregated_postings[name]
+    def series(self, aggregated=False, cumulative=True):
+        """Account ids, commodity ids, dates and quantities as returned by
+           PostingTable.account_series, worked out once"""
+        table = self.deltas
+        key = (aggregated, cumulative)
+        if key not in self.derived:
+            self.derived[key] = table.account_series(aggregated, cumulative)
+        return self.derived[key]
 
-        new_total = total + post.amount
-        series[post.date] = self.aggregated_total[name] = new_total
-        postings[post.date] = postings[post.date] + post.amount
+    @profiling.timed()
+    def prepare_valuation(self, commodity):
+        """Works out the rates of the commodities held into commodity up
+           front, asking ledger if need be, so that valuing the series in it
+           later (on the GUI thread) does not need ledger. Returns self."""
+        for symbol in self.commodities:
+            self.valuation.timeline(symbol, commodity)
+        return self
 
-        if account.parent:
-            self._aggregate(post, account.parent)
+    def prefetch(self, commodity, cumulative=(), totals=False):
+        """Here what RemoteAccounts.prefetch fetches is worked out as it is
+           asked for, ledger is not needed for it (see prepare_valuation)"""
+        return self
+
+    @profiling.timed()
+    def prepare(self):
+        """Works out the rolled up series for every depth limit up front, so
+           that changing the depth shown is just a lookup"""
+        for limit in range(self.max_depth + 1):
+            self.rollup(limit, cumulative=True)
+            self.rollup(limit, cumulative=False)
+        return self
+
+    @property
+    def names(self):
+        """Account names, indexed by the ids in the series"""
+        return self.deltas.accounts.names
+
+    @property
+    def max_depth(self):
+        table = self.deltas
+        return int(table.accounts.depth[table.account].max(initial=0))
+
+    def ancestors(self):
+        if "ancestors" not in self.derived:
+            self.derived["ancestors"] = self.deltas.accounts.ancestors()
+        return self.derived["ancestors"]
+
+    def rollup(self, limit, cumulative=True):
+        """Series as shown with the depth limited: accounts at least limit
+           deep are counted towards their ancestor at that depth, those
+           above it only have their own postings. A limit of 0 is unlimited."""
+        if limit >= self.max_depth:
+            limit = 0
+        key = ("rollup", limit, cumulative)
+        if key not in self.derived:
+            table = self.deltas
+            accounts = self.ancestors()[limit][table.account] if limit else table.account
+            self.derived[key] = table.rollup(accounts, cumulative)
+        return self.derived[key]
+
+    def account_totals(self, limit, commodity, account=""):
+        """Account ids and totals of the accounts shown with the depth limited,
+           valued in commodity as of now, in id order. Given an account, only
+           it and those below it, the limit then counts from its depth."""
+        accounts = self.deltas.accounts
+        if account:
+            if account not in accounts.index:
+                return np.zeros(0, dtype=np.int64), np.zeros(0)
+            limit = limit and accounts.depths[accounts.index[account]] + limit
+        if limit >= self.max_depth:
+            limit = 0
+        key = ("account_totals", limit, commodity)
+        if key not in self.derived:
+            table = self.deltas
+            ids, commodities, _, quantities = self.rollup(limit)
+            amounts = table.amounts(quantities, commodities)
+            # only of the commodities held, those are the ones prepared
+            held = np.unique(commodities)
+            symbols = table.commodities.symbols
+            rates = self.valuation.latest(commodity, [symbols[id] for id in held.tolist()])
+
+            # the running totals are ordered by date within each commodity
+            last = np.r_[(ids[1:] != ids[:-1]) | (commodities[1:] != commodities[:-1]), True] \
+                    if len(ids) else np.zeros(0, dtype=bool)
+            values = amounts[last] * rates[np.searchsorted(held, commodities[last])]
+            ids = ids[last]
+
+            starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]]) if len(ids) else ids
+            self.derived[key] = ids[starts], np.add.reduceat(values, starts) if len(ids) else values
+        ids, values = self.derived[key]
+
+        if account:
+            id = accounts.index[account]
+            below = self.ancestors()[accounts.depths[id]][ids] == id
+            ids, values = ids[below], values[below]
+        return ids, values
+
+    def totals(self, limit, commodity):
+        """[(name, total)] of the accounts shown with the depth limited, valued
+           in commodity as of now and largest first"""
+        if limit >= self.max_depth:
+            limit = 0
+        key = ("totals", limit, commodity)
+        if key not in self.derived:
+            ids, values = self.account_totals(limit, commodity)
+            names = self.deltas.accounts.names
+            order = np.argsort(-values, kind="stable")
+            self.derived[key] = [(names[id], total) for id, total in zip(ids[order].tolist(), values[order])]
+        return self.derived[key]
+
+    @profiling.timed()
+    def valued(self, limit, commodity, cumulative=True):
+        """[(name, total, dates, values)] of the accounts shown with the depth
+           limited, the running totals (or postings) on each date valued in
+           commodity as of that date, in the order of totals()"""
+        if limit >= self.max_depth:
+            limit = 0
+        key = ("valued", limit, commodity, cumulative)
+        if key in self.derived:
+            return self.derived[key]
+
+        table = self.deltas
+        valuation = self.valuation
+        symbols, index = table.commodities.symbols, table.accounts.index
+        ids, commodities, dates, quantities = self.rollup(limit, cumulative)
+        amounts = table.amounts(quantities, commodities)
+
+        result = []
+        for name, total in self.totals(limit, commodity):
+            start, end = np.searchsorted(ids, [index[name], index[name] + 1])
+            days = np.unique(dates[start:end])
+            values = np.zeros(len(days))
+            for first, last in groups(commodities[start:end]):
+                first, last = start + first, start + last
+                held = amounts[first:last]
+                if cumulative:
+                    # carry the running total over to the days it did not change
+                    i = np.searchsorted(dates[first:last], days, side="right") - 1
+                    held = np.where(i >= 0, held[np.maximum(i, 0)], 0)
+                else:
+                    held = np.zeros(len(days))
+                    held[np.searchsorted(days, dates[first:last])] = amounts[first:last]
+                values += held * valuation.rates(symbols[commodities[first]], commodity, days)
+            result.append((name, total, days, values))
+
+        self.derived[key] = result
+        return result
+
+    def balance(self, quantities):
+        """Turns {commodity id: quantity} into a ledger Balance"""
+        commodities = self.deltas.commodities
+        pool = self.source.commodities
+        balance = ledger.Balance()
+        for id, quantity in quantities.items():
+            if not quantity:
+                continue
+            number = Decimal("{}e-{}".format(int(quantity), commodities.decimals[id]))
+            amount = ledger.Amount(format(number, "f"))
+            amount.commodity = pool.find(commodities.symbols[id])
+            balance = balance + amount
+        return balance
 
     def post_callback(self, post):
-        self.commodities.add(post.amount.commodity.symbol)
+        self.pending.append(post)
+
+    def extended(self, table):
+        """A new StatefulAccounts with the postings of a table sharing the
+           side tables of this one added, this one may still be in use"""
+        return StatefulAccounts(self.source, self.deltas.extend(table)).prepare()
+
+class AccountView(Mapping):
+    """Account name -> running totals (or postings) by date, or just the final
+       total, as ledger Balances in the way StatefulAccounts used to keep them"""
+    def __init__(self, accounts, kind, aggregated=False):
+        self.accounts = accounts
+        self.kind = kind
+        self.aggregated = aggregated
+
+    def _series(self):
+        return self.accounts.series(self.aggregated, self.kind != "postings")
+
+    def __iter__(self):
+        ids, _, _, _ = self._series()
+        names = self.accounts.deltas.accounts.names
+        return (names[id] for id in np.unique(ids))
 
-        account = post.account
+    def __len__(self):
+        ids, _, _, _ = self._series()
+        return len(np.unique(ids))
 
-        name = account.fullname()
-        total = self.total[name]
-        series = self.running_total[name]
-        postings = self.postings[name]
+    def __contains__(self, name):
+        return len(self._rows(name)[0]) > 0
 
-        new_total = total + post.amount
-        series[post.date] = self.total[name] = new_total
-        postings[post.date] = postings[post.date] + post.amount
-        self._aggregate(post, account)
+    def _rows(self, name):
+        ids, commodities, dates, quantities = self._series()
+        id = self.accounts.deltas.accounts.index.get(name, -1)
+        start, end = np.searchsorted(ids, [id, id + 1])
+        return commodities[start:end], dates[start:end], quantities[start:end]
+
+    def __getitem__(self, name):
+        commodities, dates, quantities = self._rows(name)
+        balance = self.accounts.balance
+
+        if self.kind == "total":
+            # the last running total of each commodity
+            last = np.r_[commodities[1:] != commodities[:-1], True] if len(commodities) else []
+            return balance(dict(zip(commodities[last].tolist(), quantities[last].tolist())))
+
+        series = {}
+        current = {}
+        order = np.argsort(dates, kind="stable")
+        for start, end in groups(dates[order]):
+            rows = order[start:end]
+            if self.kind == "postings":
+                current = {}
+            current.update(zip(commodities[rows].tolist(), quantities[rows].tolist()))
+            series[date.fromordinal(int(dates[rows[0]]))] = balance(current)
+        return series
 
 class Journal:
-    def __init__(self, filename, effective_date=True):
+    @profiling.timed("Journal.load")
+    def __init__(self, filename, effective_date=True, cache_size=8, progress=None,
+                 use_cache=True):
         self.ledger = ledger
-        self.journal = ledger.read_journal(filename)
+        self.lock = lock
+        self.filename = filename
+        self.identity = self.identify()
         self.effective_date = effective_date
 
+        # what gets extracted from ledger, possibly from the on-disk cache in
+        # which case the file is only parsed if ledger is needed after all.
+        # cold is whether ledger had to extract it, only then is it asked for
+        # the prices the price history lacks (see Valuation).
+        self._journal = None
+        self.use_cache = use_cache
+        self.cold = False
+        self.stamp = None
+        self.tables = {}
+        self.price_history = {}
+        self.precisions = {}
+        self.valuation = Valuation(self)
+
+        # results shared by all the tabs, keyed by what they were computed from
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+        self.postings(progress=progress)
+
+    @property
+    def journal(self):
+        if self._journal is None:
+            with profiling.span("ledger.read_journal"):
+                self._journal = self.ledger.read_journal(self.filename)
+        return self._journal
+
     @property
     def commodities(self):
+        # the commodity pool is only filled in once the file has been parsed
+        self.journal
         return self.ledger.commodities
 
+    @property
+    def prices(self):
+        self.postings()
+        return self.price_history[bool(self.effective_date)]
+
+    @property
+    def symbols(self):
+        """The commodities of the postings extracted so far, this never has
+           anything extracted (it is asked for on the GUI thread)"""
+        tables = list(self.tables.values())
+        return list(dict.fromkeys(symbol for table in tables
+                                  for symbol in table.commodities.symbols if symbol))
+
+    @property
+    def sources(self):
+        """The journals the postings come from, see PostingTable.source"""
+        return [self.filename]
+
+    def identify(self):
+        return file_identity(self.filename)
+
     def set_effective_date(self, effective_date):
-        self.effective_date = effective_date
+        self.effective_date = bool(effective_date)
+
+    def effective(self, effective=None):
+        """Whether to use effective dates, as given or as set for the journal"""
+        return bool(self.effective_date if effective is None else effective)
+
+    def cached(self, key, compute, effective=None):
+        """Returns the result of compute() for key, reusing the result from an
+           earlier call with the same key, options and file if there is one"""
+        key = key + (self.effective(effective), self.identity)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
 
-    def entries(self, filter):
+        result = self.cache[key] = compute()
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return result
+
+    @profiling.timed("ledger.query")
+    def entries(self, filter, effective=None):
         options = ["--sort d"]
-        if self.effective_date:
+        if self.effective(effective):
             options.append("--effective")
         return self.journal.query(" ".join(options + [filter]))
 
-    def update_pricedb(self, amount):
-        if amount.has_annotation() and amount.annotation.price:
-            self.ledger.commodities.exchange(amount.commodity,
-                                             amount.annotation.price)
-
-    def time_series(self, filter, show_currency=None, merge=False):
-        if show_currency and isinstance(show_currency, str):
-            show_currency = self.ledger.commodities.find(show_currency)
-        running_total = defaultdict(dict)
-        total = defaultdict(ledger.Amount)
-        for post in self.entries(filter):
-            commodity = post.amount.commodity
-            if merge:
-                commodity = show_currency
-            old = total[commodity.symbol]
-            old.commodity = show_currency or commodity
-            series = running_total[commodity.symbol]
-            # TODO: move the currency valuation to display logic instead
-            value = post.amount
-            if show_currency:
-                # Exchange does not always seem to pick up the conversion even
-                # when available. We can try and hint it
-                if value.value(show_currency) is None:
-                    self.update_pricedb(value)
-                value = value.value(show_currency)
-                if value is None:
-                    value = 0
-            total[commodity.symbol] = series[post.date] = series.get(post.date, old) + value
-
-        return running_total, total
-
-    def account_series(self, filter):
-        account_series = StatefulAccounts(self)
-        for post in self.entries(filter):
-            account_series.post_callback(post)
-
-        return account_series
+    def postings(self, filter="", progress=None, partial=None, effective=None):
+        """The postings matching filter as a PostingTable, all of them are
+           extracted once and the filtered ones share its account and commodity
+           tables. partial(table) is given what ledger returned so far while it
+           runs a query (see PostingTable.from_posts)."""
+        effective = self.effective(effective)
+        if effective not in self.tables:
+            self.tables[effective] = self.extract(effective, progress)
+        table = self.tables[effective]
+        if not filter.strip():
+            return table
+
+        return self.cached(("postings", filter),
+                           lambda: self.filtered(table, filter, progress, partial, effective),
+                           effective)
+
+    @profiling.timed()
+    def filtered(self, table, filter, progress=None, partial=None, effective=None):
+        """Evaluates the query on the extracted postings when it is simple
+           enough, otherwise has ledger run it"""
+        try:
+            return table.select(query.evaluate(filter, table))
+        except query.Unsupported:
+            return PostingTable.from_posts(self.entries(filter, effective), table, progress, partial)
+
+    @profiling.timed()
+    def extract(self, effective, progress=None):
+        stamp = self.stamp = cache.fingerprint(self.filename)
+        if self.use_cache:
+            cached = cache.load(self.filename, effective, stamp)
+            if cached:
+                table, self.price_history[effective], self.precisions = cached
+                return table
+
+        table = PostingTable.from_posts(self.entries("", effective), progress=progress)
+        self.cold = True
+        profiling.count(posts=len(table))
+        self.precisions, prices = price_history(self.commodities, table.commodities)
+        self.price_history[effective] = prices
+
+        if self.use_cache:
+            cache.save(self.filename, effective, table, prices, self.precisions, stamp)
+        return table
+
+    @profiling.timed()
+    def refresh(self, progress=None):
+        """Catches up with changes to the journal files. If transactions were
+           only appended, just those are parsed and added to what was already
+           extracted, anything else has the journal reloaded. Returns whether
+           anything changed."""
+        if self.stamp is None or not cache.changed(self.stamp):
+            return False
+
+        stamp = cache.fingerprint(self.filename)
+        pieces = self.appended(stamp)
+        if pieces is None:
+            self.reload(progress)
+            return True
+
+        try:
+            self.append(pieces, stamp)
+        except ValueError:
+            self.reload(progress)
+        return True
+
+    def appended(self, stamp):
+        """Parses what was added to the end of the journal files since stamp
+           was taken, None if more than that changed"""
+        offsets = cache.appended(self.stamp, stamp)
+        if offsets is None or cache.contextual(self.stamp):
+            return None
+
+        text = ""
+        for name, (offset, size) in offsets.items():
+            piece = cache.read_tail(name, offset, size)
+            if piece is None or not cache.standalone(piece):
+                return None
+            text += piece
+        try:
+            return parse_elsewhere(text, list(self.tables))
+        except Exception:
+            # the reload will tell if the journal is broken
+            return None
+
+    def append(self, pieces, stamp):
+        """Adds what parse_piece returned to the tables and all the results
+           that were computed from them, ValueError if it does not fit"""
+        tables, prices, precisions = pieces
+        if len(prices):
+            # ledger works out the rates between other pairs through them too
+            raise ValueError("prices were added")
+        added = {}
+        for effective, table in self.tables.items():
+            piece = added[effective] = tables[effective].rebase(table)
+            self.tables[effective] = table.extend(piece)
+
+        for symbol, precision in precisions.items():
+            self.precisions[symbol] = max(precision, self.precisions.get(symbol, 0))
+        # ledger's session and what was asked of it are out of date now
+        self._journal = None
+        self.valuation = Valuation(self)
+
+        results, self.cache = self.cache, OrderedDict()
+        self.identity = self.identify()
+        for key, result in results.items():
+            # the series also have the source in their key, here there is the one
+            kind, filter, effective = key[0], key[1], key[-2]
+            piece = added[effective]
+            try:
+                piece = piece.select(query.evaluate(filter, piece))
+            except query.Unsupported:
+                continue
+            if kind == "postings":
+                result = result.extend(piece)
+            else:
+                result = result.extended(piece)
+            self.cache[key[:-1] + (self.identity,)] = result
+
+        self.stamp = stamp
+        if self.use_cache:
+            for effective, table in self.tables.items():
+                cache.save(self.filename, effective, table, self.price_history[effective],
+                           self.precisions, stamp)
+
+    def reload(self, progress=None):
+        self._journal = None
+        self.stamp = None
+        self.price_history = {}
+        self.valuation = Valuation(self)
+        self.cache.clear()
+        self.identity = self.identify()
+        # the tables there were stay until there is one to replace them
+        effective = self.effective()
+        self.tables = {effective: self.extract(effective, progress)}
+
+    def precision(self, symbol):
+        return self.precisions.get(symbol, 0)
+
+    def time_series(self, filter, show_currency=None, merge=False, progress=None,
+                    partial=None, source=None, effective=None):
+        """Running totals per commodity as (dates, totals) arrays, valued in
+           show_currency if set. partial gets the same for the postings so far
+           if the query takes ledger a while. Given a source, only for the
+           postings from that journal. Given effective, it is used instead of
+           the journal's setting."""
+        if show_currency and not isinstance(show_currency, str):
+            show_currency = show_currency.symbol
+
+        def shown(series):
+            if not show_currency:
+                return series.running_total, series.total
+            return series.valued(show_currency, bool(merge))
+
+        snapshot = partial and (lambda table: partial(shown(TimeSeries(self, table).prepare())))
+        return shown(self.cached(("time_series", filter, source),
+                                 lambda: self._time_series(filter, progress, snapshot, source,
+                                                           effective),
+                                 effective))
+
+    @profiling.timed("Journal.time_series")
+    def _time_series(self, filter, progress=None, partial=None, source=None, effective=None):
+        table = self.postings(filter, progress, partial, effective)
+        if source is not None:
+            table = table.select(table.source == source)
+        profiling.count(posts=len(table))
+        return TimeSeries(self, table).prepare()
+
+    def account_series(self, filter, progress=None, partial=None, source=None, effective=None,
+                       commodity=None):
+        """StatefulAccounts of the postings matching filter, the arguments are
+           those of time_series. Given a commodity, they are ready to be valued
+           in it without ledger (see StatefulAccounts.prepare_valuation)."""
+        def prepared(series):
+            return series.prepare_valuation(commodity) if commodity else series
+
+        snapshot = partial and (lambda table: partial(prepared(StatefulAccounts(self, table))))
+        return prepared(self.cached(("account_series", filter, source),
+                                    lambda: self._account_series(filter, progress, snapshot,
+                                                                 source, effective),
+                                    effective))
+
+    @profiling.timed("Journal.account_series")
+    def _account_series(self, filter, progress=None, partial=None, source=None, effective=None):
+        table = self.postings(filter, progress, partial, effective)
+        if source is not None:
+            table = table.select(table.source == source)
+        profiling.count(posts=len(table))
+        return StatefulAccounts(self, table).prepare()
+
+class MergedJournal(Journal):
+    """Several journals as one. Each is extracted in a process of its own, all
+       of them at the same time, and their postings merged in date order on
+       shared account and commodity tables, with the position of the journal
+       each came from as its source. ledger's session here only reads them
+       all if it is asked for a price their price histories do not have, and
+       one of them was not in the on-disk cache."""
+    def __init__(self, filenames, effective_date=True, cache_size=8, progress=None,
+                 use_cache=True):
+        self.filenames = list(filenames)
+        super(MergedJournal, self).__init__(" + ".join(self.filenames), effective_date,
+                                            cache_size, progress, use_cache)
+
+    @property
+    def journal(self):
+        if self._journal is None:
+            text = "".join("include {}\n".format(os.path.abspath(filename))
+                           for filename in self.filenames)
+            with profiling.span("ledger.read_journal"):
+                self._journal = self.ledger.read_journal_from_string(text)
+        return self._journal
+
+    @property
+    def sources(self):
+        return self.filenames
+
+    def identify(self):
+        return tuple(file_identity(filename) for filename in self.filenames)
+
+    def collect(self, function, calls, progress=None):
+        """elsewhere() in the order of calls, reporting the postings found"""
+        results, posts = [None] * len(calls), 0
+        for i, result in elsewhere(function, calls):
+            results[i] = result
+            posts += len(result[0] if isinstance(result, tuple) else result)
+            if progress:
+                progress(posts)
+        return results
+
+    @profiling.timed("MergedJournal.extract")
+    def extract(self, effective, progress=None):
+        results = self.collect(extract_file, [(filename, effective, self.use_cache)
+                                              for filename in self.filenames], progress)
+        tables, prices, precisions, stamps, colds = zip(*results)
+        self.cold = any(colds)
+        table = merge(tables)
+        profiling.count(posts=len(table), journals=len(tables))
+
+        history = None
+        for part, part_prices in zip(tables, prices):
+            part_prices = part_prices.remap(table.commodities.merge(part.commodities))
+            history = part_prices if history is None else history.extend(part_prices)
+        self.price_history[effective] = history
+
+        self.precisions = {}
+        for part in precisions:
+            for symbol, precision in part.items():
+                self.precisions[symbol] = max(precision, self.precisions.get(symbol, 0))
+        self.stamp = dict(zip(self.filenames, stamps))
+        return table
+
+    @profiling.timed("MergedJournal.filtered")
+    def filtered(self, table, filter, progress=None, partial=None, effective=None):
+        """Has ledger run the queries query.evaluate cannot in a process per
+           journal, what comes back cannot be shown as it comes"""
+        try:
+            return table.select(query.evaluate(filter, table))
+        except query.Unsupported:
+            pass
+        effective = self.effective(effective)
+        tables = self.collect(query_file, [(filename, filter, effective)
+                                           for filename in self.filenames], progress)
+        return merge(tables, table)
+
+    def refresh(self, progress=None):
+        """Any of the journals changing has them all extracted again, those
+           that did not change then come from the on-disk cache"""
+        if self.stamp is None or not any(cache.changed(stamp) for stamp in self.stamp.values()):
+            return False
+        self.reload(progress)
+        return True
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""Exports the series the visualizer plots to CSV, Parquet or Arrow files, a
+chunk of rows at a time so that only what is already computed for the plots
+is held in memory in full.
+
+    time_series  date, commodity, total: the running total per commodity
+    running      date, account, commodity, amount: each account's running
+                 total, accounts below the depth counted towards their parent
+    aggregated   the same with each account including those below it
+    postings     the same as running, with what changed on each date instead
+    bars         period, account, value: what each account changed by per
+                 period, as the bars show it
+
+Given a commodity, totals are valued in it and the account series get a
+value column with the amount valued in it as of that date. Parquet and Arrow
+need pyarrow installed."""
+import argparse
+import csv
+import os
+import sys
+
+import numpy as np
+
+from postings import PERIODS, to_datetime64
+
+DATASETS = ("time_series", "running", "aggregated", "postings", "bars")
+FORMATS = {".csv": "csv", ".parquet": "parquet", ".arrow": "arrow", ".feather": "arrow"}
+# rows written at a time
+CHUNK_SIZE = 1 << 16
+
+# the type of each column there is, dates are written as YYYY-MM-DD to CSV
+TYPES = {"date": "date", "period": "date", "account": "string", "commodity": "string",
+         "amount": "double", "total": "double", "value": "double"}
+
+def time_series(journal, filter="", commodity="", merge=False, effective=None, **ignored):
+    """(columns, chunks) of the running totals per commodity"""
+    running_total, _ = journal.time_series(filter, commodity, merge, effective=effective)
+    def chunks():
+        for symbol, (dates, totals) in running_total.items():
+            for start in range(0, len(dates), CHUNK_SIZE):
+                end = start + CHUNK_SIZE
+                yield {"date": to_datetime64(dates[start:end]),
+                       "commodity": np.full(len(dates[start:end]), symbol, dtype=object),
+                       "total": totals[start:end]}
+    return ("date", "commodity", "total"), chunks()
+
+def accounts(journal, dataset, filter="", commodity="", depth=0, effective=None, **ignored):
+    """(columns, chunks) of a series of StatefulAccounts, as returned by its
+       series() or rollup()"""
+    series = journal.account_series(filter, effective=effective)
+    if not hasattr(series, "rollup"):
+        raise RuntimeError("Exporting {} needs the journal loaded here".format(dataset))
+    table = series.deltas
+    if dataset == "aggregated":
+        # the root, holding everything, is left out as it is everywhere else
+        ids, commodities, dates, quantities = series.series(aggregated=True)
+        limit = depth if depth and depth < series.max_depth else series.max_depth
+    else:
+        ids, commodities, dates, quantities = series.rollup(depth, dataset == "running")
+        limit = None
+
+    names, depths = np.array(table.accounts.names, dtype=object), table.accounts.depth
+    symbols = np.array(table.commodities.symbols, dtype=object)
+    valuation = journal.valuation
+    columns = ("date", "account", "commodity", "amount") + (("value",) if commodity else ())
+
+    def chunks():
+        for start in range(0, len(ids), CHUNK_SIZE):
+            rows = slice(start, start + CHUNK_SIZE)
+            if limit is not None:
+                shown = depths[ids[rows]]
+                rows = start + np.flatnonzero((shown > 0) & (shown <= limit))
+            held, days = commodities[rows], dates[rows]
+            amounts = table.amounts(quantities[rows], held)
+            chunk = {"date": to_datetime64(days), "account": names[ids[rows]],
+                     "commodity": symbols[held], "amount": amounts}
+            if commodity:
+                values = np.zeros(len(amounts))
+                for id in np.unique(held):
+                    here = held == id
+                    values[here] = amounts[here] * valuation.rates(symbols[id], commodity, days[here])
+                chunk["value"] = values
+            yield chunk
+    return columns, chunks()
+
+def bars(journal, filter="", commodity="", depth=0, period="month", first_month=1,
+         effective=None, **ignored):
+    """(columns, chunks) of the sums the bars show"""
+    import render
+    if not commodity:
+        raise ValueError("The bars are only summed up in terms of a commodity")
+    series = journal.account_series(filter, effective=effective)
+    valued, index, starts, sums = render.period_totals(series, depth, commodity, period, first_month)
+    names = np.array([name for name, _, _, _ in valued], dtype=object)
+    def chunks():
+        for start in range(0, len(index), CHUNK_SIZE):
+            end = start + CHUNK_SIZE
+            yield {"period": to_datetime64(starts[start:end]), "account": names[index[start:end]],
+                   "value": sums[start:end]}
+    return ("period", "account", "value"), chunks()
+
+def dataset(journal, name, **settings):
+    if name == "time_series":
+        return time_series(journal, **settings)
+    if name == "bars":
+        return bars(journal, **settings)
+    if name in DATASETS:
+        return accounts(journal, name, **settings)
+    raise ValueError("Unknown series to export: {}".format(name))
+
+def write_csv(filename, columns, chunks, progress=None):
+    rows = 0
+    with open(filename, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for chunk in chunks:
+            values = [chunk[name].astype(str) if TYPES[name] == "date" else chunk[name]
+                      for name in columns]
+            writer.writerows(zip(*(column.tolist() for column in values)))
+            rows += len(values[0])
+            if progress:
+                progress(rows)
+    return rows
+
+def write_arrow(filename, columns, chunks, format="parquet", progress=None):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Writing {} files needs pyarrow".format(format))
+
+    types = {"date": pa.date32(), "string": pa.string(), "double": pa.float64()}
+    schema = pa.schema([(name, types[TYPES[name]]) for name in columns])
+    if format == "parquet":
+        writer = pa.parquet.ParquetWriter(filename, schema)
+    else:
+        writer = pa.ipc.new_file(filename, schema)
+
+    rows = 0
+    with writer:
+        for chunk in chunks:
+            writer.write_table(pa.table([pa.array(chunk[name], type=field.type)
+                                         for name, field in zip(columns, schema)], schema=schema))
+            rows += len(chunk[columns[0]])
+            if progress:
+                progress(rows)
+    return rows
+
+def export(journal, filename, name, format=None, progress=None, **settings):
+    """Writes the series called name (one of DATASETS) to filename, in the
+       format its extension stands for unless given. settings are any of
+       filter, commodity, depth, merge, period, first_month and effective.
+       Returns the number of rows written, a file only partly written is
+       removed."""
+    format = format or FORMATS.get(os.path.splitext(filename)[1].lower())
+    if format not in FORMATS.values():
+        raise ValueError("Cannot tell what format to write {} in".format(filename))
+    columns, chunks = dataset(journal, name, **settings)
+    try:
+        if format == "csv":
+            return write_csv(filename, columns, chunks, progress)
+        return write_arrow(filename, columns, chunks, format, progress)
+    except BaseException:
+        if os.path.exists(filename):
+            os.remove(filename)
+        raise
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("journal")
+    parser.add_argument("output", help="file to write, its extension picks the format")
+    parser.add_argument("--series", choices=DATASETS, default="time_series")
+    parser.add_argument("--format", choices=sorted(set(FORMATS.values())),
+                        help="overrides what the extension says")
+    parser.add_argument("--filter", default="", help="ledger query to restrict postings to")
+    parser.add_argument("--commodity", default="", help="value everything in this commodity")
+    parser.add_argument("--depth", type=int, default=0, help="account depth to show, 0 for unlimited")
+    parser.add_argument("--merge", action="store_true", help="merge commodities into one series")
+    parser.add_argument("--period", choices=sorted(PERIODS), default="month",
+                        help="what the bars sum up by")
+    parser.add_argument("--first-month", type=int, choices=range(1, 13), default=1, metavar="MONTH",
+                        help="month (fiscal) quarters and years start in")
+    parser.add_argument("--effective", action="store_true", help="use effective dates")
+    args = parser.parse_args(argv)
+
+    from datasource import Journal
+    journal = Journal(args.journal, effective_date=args.effective)
+    try:
+        rows = export(journal, args.output, args.series, args.format, filter=args.filter,
+                      commodity=args.commodity, depth=args.depth, merge=args.merge,
+                      period=args.period, first_month=args.first_month)
+    except (ValueError, RuntimeError, OSError) as e:
+        print("{}: {}".format(args.output, e), file=sys.stderr)
+        return 1
+    print("{}: {} rows".format(args.output, rows), file=sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,683 @@
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from decimal import Decimal
+from itertools import chain
+
+import numpy as np
+
+# quantities are kept as integers in units of 10**-decimals of their commodity
+# so that sums come out exactly as ledger computes them, as int64 as long as
+# no total of them can get anywhere near overflowing it (see exact)
+SAFE_TOTAL = 2.0 ** 62
+# how many postings to process between progress reports
+PROGRESS_INTERVAL = 10000
+# how often from_posts hands out what it has extracted so far, in seconds
+PARTIAL_INTERVAL = 0.5
+EPOCH = date(1970, 1, 1).toordinal()
+# tables smaller than this are not worth splitting up for running()
+SHARD_SIZE = 1 << 19
+
+# threads running() splits big tables across, see parallel()
+pool = None
+threads = 1
+
+def to_datetime64(ordinals):
+    return (np.asarray(ordinals, dtype=np.int64) - EPOCH).astype('datetime64[D]')
+
+def decimal(amount):
+    # the display precision of the commodity might be lower than what is stored
+    return Decimal(amount.number().to_fullstring())
+
+def units(number, places):
+    """A Decimal as an integer number of 10**-places, ValueError rather than
+       rounding it"""
+    sign, digits, exponent = number.as_tuple()
+    value = int("".join(map(str, digits)) or 0)
+    if exponent + places < 0:
+        value, rest = divmod(value, 10 ** -(exponent + places))
+        if rest:
+            raise ValueError("{} has more than {} decimal places".format(number, places))
+    else:
+        value *= 10 ** (exponent + places)
+    return -value if sign else value
+
+def exact(quantities):
+    """Integer quantities as int64 if no total of them can overflow it, as an
+       array of python ints otherwise"""
+    try:
+        narrow = np.asarray(quantities, dtype=np.int64)
+    except OverflowError:
+        return np.array(quantities, dtype=object)
+    if np.abs(narrow.astype(np.float64)).sum() < SAFE_TOTAL:
+        return narrow
+    return narrow.astype(object)
+
+def scaled(quantities, places):
+    """quantities times 10**places of each, exactly (see exact)"""
+    if quantities.dtype != object and \
+            (np.abs(quantities.astype(np.float64)) * 10.0 ** places).sum() < SAFE_TOTAL:
+        return quantities * 10 ** places.astype(np.int64)
+    return exact(quantities.astype(object) * 10 ** places.astype(object))
+
+class Accounts:
+    """Account names with their place in the hierarchy, the id of the master
+       account ("") is always 0"""
+    def __init__(self, names=("",)):
+        self.names = []
+        self.index = {}
+        self.parents = []
+        self.depths = []
+        for name in names:
+            self.add(name)
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name):
+        id = self.index.get(name)
+        if id is not None:
+            return id
+
+        if name:
+            parent, _, _ = name.rpartition(":")
+            parent = self.add(parent)
+            depth = self.depths[parent] + 1
+        else:
+            parent, depth = -1, 0
+
+        id = self.index[name] = len(self.names)
+        self.names.append(name)
+        self.parents.append(parent)
+        self.depths.append(depth)
+        return id
+
+    def merge(self, other):
+        """Adds the accounts of other, returns the ids they have here indexed
+           by their ids there"""
+        return np.array([self.add(name) for name in other.names], dtype=np.int32)
+
+    @property
+    def parent(self):
+        return np.array(self.parents, dtype=np.int32)
+
+    @property
+    def depth(self):
+        return np.array(self.depths, dtype=np.int32)
+
+    def ancestors(self):
+        """Table of ancestors, indexed by depth then account id"""
+        depth = int(max(self.depths))
+        return np.stack([self.ancestor_at(level) for level in range(depth + 1)])
+
+    def ancestor_at(self, depth):
+        """For each account, its ancestor at the given depth (or the account
+           itself if it is not that deep)"""
+        ancestors = np.arange(len(self), dtype=np.int32)
+        parent, depths = self.parent, self.depth
+        for _ in range(int(depths.max(initial=0)) - depth):
+            deeper = depths[ancestors] > depth
+            ancestors[deeper] = parent[ancestors[deeper]]
+        return ancestors
+
+class Names:
+    """Interned strings (payees, tag names and values)"""
+    def __init__(self, names=()):
+        self.names = []
+        self.index = {}
+        for name in names:
+            self.add(name)
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name):
+        id = self.index.get(name)
+        if id is None:
+            id = self.index[name] = len(self.names)
+            self.names.append(name)
+        return id
+
+    def merge(self, other):
+        return np.array([self.add(name) for name in other.names], dtype=np.int32)
+
+def parse_tags(note):
+    """Yields the (tag, value) pairs in a note the way ledger reads them, value
+       is None for tags given as :tag1:tag2:. Only the first word of a line
+       can be a Key: (or Key::) tag, its value is the rest of the line."""
+    for line in (note or "").splitlines():
+        tag, first = None, True
+        for match in re.finditer(r"\S+", line):
+            word = match.group()
+            # ledger skips single characters, even as the value
+            if len(word) < 2:
+                continue
+            if tag is not None:
+                yield tag, line[match.start():].strip()
+                break
+            if word.startswith(":") and word.endswith(":"):
+                for name in word.split(":"):
+                    if name:
+                        yield name, None
+                # ledger stops reading the line there
+                break
+            if first and word.endswith(":"):
+                tag = word[:-2] if word.endswith("::") else word[:-1]
+            first = False
+
+class Commodities:
+    def __init__(self, symbols=(), decimals=()):
+        self.symbols = []
+        self.index = {}
+        self.decimals = []
+        for symbol, places in zip(symbols, decimals):
+            self.add(symbol, places)
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def add(self, symbol, decimals=0):
+        id = self.index.get(symbol)
+        if id is None:
+            id = self.index[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+            self.decimals.append(decimals)
+        return id
+
+    def merge(self, other):
+        """Same as Accounts.merge, raises ValueError if other has more decimal
+           places for a commodity than the quantities here are stored with"""
+        ids = []
+        for symbol, places in zip(other.symbols, other.decimals):
+            id = self.add(symbol, places)
+            if self.decimals[id] < places:
+                raise ValueError("{} needs more decimal places".format(symbol))
+            ids.append(id)
+        return np.array(ids, dtype=np.int32)
+
+    @property
+    def scale(self):
+        return 10.0 ** np.array(self.decimals, dtype=np.int64)
+
+class Prices:
+    """Price history as parallel arrays of source and target commodity ids,
+       date ordinal and what one unit of source was worth in target"""
+    def __init__(self, source, target, date, rate):
+        self.source = source
+        self.target = target
+        self.date = date
+        self.rate = rate
+
+    def __len__(self):
+        return len(self.date)
+
+    def remap(self, ids):
+        """The same prices with commodity ids translated through ids"""
+        return Prices(ids[self.source], ids[self.target], self.date, self.rate)
+
+    def extend(self, other):
+        return Prices(np.concatenate((self.source, other.source)),
+                      np.concatenate((self.target, other.target)),
+                      np.concatenate((self.date, other.date)),
+                      np.concatenate((self.rate, other.rate)))
+
+    @classmethod
+    def from_pool(cls, pool, commodities):
+        """Walks ledger's price history between each pair of commodities,
+           newest to oldest"""
+        rows = []
+        for source, symbol in enumerate(commodities.symbols):
+            commodity = symbol and pool.find(symbol)
+            if not commodity:
+                continue
+            for target, other in enumerate(commodities.symbols):
+                other = other and pool.find(other)
+                if not other or source == target:
+                    continue
+
+                point = commodity.find_price(other)
+                while point:
+                    rows.append((source, target, point.when.date().toordinal(),
+                                 float(point.price.number())))
+                    moment = point.when - timedelta(seconds=1)
+                    point = commodity.find_price(other, moment)
+                    if point and point.when > moment:
+                        break
+
+        rows.reverse()
+        source, target, dates, rate = zip(*rows) if rows else ((), (), (), ())
+        return cls(np.array(source, dtype=np.int32), np.array(target, dtype=np.int32),
+                   np.array(dates, dtype=np.int32), np.array(rate, dtype=np.float64))
+
+def parallel(workers=None):
+    """Has running() split big tables into date ranges worked on by workers
+       threads at once, as many as there are cores if None, 0 to stop"""
+    global pool, threads
+    if pool is not None:
+        pool.shutdown()
+        pool = None
+    threads = os.cpu_count() if workers is None else max(workers, 1)
+    if threads > 1:
+        pool = ThreadPoolExecutor(threads, thread_name_prefix="running")
+
+def running(keys, dates, quantities, cumulative=True):
+    """Groups rows (which are in date order) by key and date, returning the
+       keys and dates with the running total at the end of that date (or just
+       the sum for that date if not cumulative), ordered by key then date"""
+    if not len(keys):
+        return keys, dates, quantities
+    # sums of floats would come out differently depending on the split
+    if (pool is not None and len(keys) >= 2 * SHARD_SIZE
+            and np.issubdtype(quantities.dtype, np.integer)
+            and not (dates[1:] < dates[:-1]).any()):
+        return sharded(keys, dates, quantities, cumulative)
+    return _running(keys, dates, quantities, cumulative)
+
+def sharded(keys, dates, quantities, cumulative=True):
+    """running() on a range of dates per thread. Each range's running totals
+       start from zero, the totals of the ranges before it are added after."""
+    count = min(threads, len(keys) // SHARD_SIZE)
+    bounds = np.searchsorted(dates, dates[np.arange(1, count) * len(keys) // count])
+    bounds = np.unique(np.r_[0, bounds, len(keys)])
+    pieces = list(pool.map(lambda b: _running(keys[b[0]:b[1]], dates[b[0]:b[1]],
+                                              quantities[b[0]:b[1]], cumulative),
+                           zip(bounds[:-1], bounds[1:])))
+
+    shard = np.repeat(np.arange(len(pieces)), [len(piece[0]) for piece in pieces])
+    keys, dates, totals = (np.concatenate(column) for column in zip(*pieces))
+    # no date is in two ranges so within a key, the ranges follow each other
+    order = np.argsort(keys, kind="stable")
+    keys, dates, totals, shard = keys[order], dates[order], totals[order], shard[order]
+    if not cumulative:
+        return keys, dates, totals
+
+    # what each key had at the end of each range it shows up in
+    starts = np.flatnonzero(np.r_[True, (keys[1:] != keys[:-1]) | (shard[1:] != shard[:-1])])
+    ends = np.r_[starts[1:], len(keys)] - 1
+    closing = totals[ends]
+    carried = np.cumsum(closing) - closing
+    first = np.flatnonzero(np.r_[True, keys[starts][1:] != keys[starts][:-1]])
+    carried -= np.repeat(carried[first], np.diff(np.r_[first, len(starts)]))
+    totals += np.repeat(carried, ends - starts + 1)
+    return keys, dates, totals
+
+def _running(keys, dates, quantities, cumulative=True):
+    if not len(keys):
+        return keys, dates, quantities
+
+    order = np.lexsort((dates, keys))
+    keys, dates, quantities = keys[order], dates[order], quantities[order]
+
+    last = np.empty(len(keys), dtype=bool)
+    last[:-1] = (keys[1:] != keys[:-1]) | (dates[1:] != dates[:-1])
+    last[-1] = True
+
+    totals = np.cumsum(quantities)
+    if cumulative:
+        first = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        offsets = totals[first] - quantities[first]
+        totals -= np.repeat(offsets, np.diff(np.r_[first, len(keys)]))
+    else:
+        ends = np.flatnonzero(last)
+        totals = np.diff(np.r_[0, totals[ends]])
+        return keys[ends], dates[ends], totals
+
+    return keys[last], dates[last], totals[last]
+
+class Partial:
+    """The postings from_posts has extracted so far as tables sharing the side
+       tables of like, converting only what was added since the last one.
+       Commodities like does not know yet get a copy of its commodities, the
+       places they need are only known at the end."""
+    def __init__(self, like):
+        self.like = like
+        self.taken = time.monotonic()
+        self.done = 0
+        # symbols in the order first seen and the chunks converted so far as
+        # (date, account, symbol, quantity, places of each symbol, payee)
+        self.symbols = {}
+        self.chunks = []
+
+    def due(self):
+        return time.monotonic() - self.taken >= PARTIAL_INTERVAL
+
+    def decimals(self, places):
+        known = self.like.commodities
+        return np.array([known.decimals[known.index[symbol]] if symbol in known.index
+                         else places[symbol] for symbol in self.symbols],
+                        dtype=np.int64)
+
+    def take(self, dates, account_ids, symbols, numbers, payees, tagged, places, hints):
+        start, end = self.done, len(dates)
+        local = np.array([self.symbols.setdefault(symbol, len(self.symbols))
+                          for symbol in symbols[start:end]], dtype=np.int32)
+        decimals = self.decimals(places)
+        scale = decimals.tolist()
+        quantity = exact([units(number, scale[id])
+                          for id, number in zip(local.tolist(), numbers[start:end])])
+        self.chunks.append((np.array(dates[start:end], dtype=np.int32),
+                            np.array(account_ids[start:end], dtype=np.int32),
+                            local, quantity, decimals,
+                            np.array(payees[start:end], dtype=np.int32)))
+        self.done = end
+
+        # places only grow, earlier chunks are scaled up to what is needed now
+        decimals = self.decimals(places)
+        quantity = exact(np.concatenate([scaled(quantity, (decimals[:len(used)] - used)[local])
+                                         for _, _, local, quantity, used, _ in self.chunks]))
+        commodities = self.like.commodities
+        if any(symbol not in commodities.index for symbol in self.symbols):
+            commodities = Commodities(commodities.symbols, commodities.decimals)
+            for symbol, places in zip(self.symbols, decimals):
+                commodities.add(symbol, places)
+        ids = np.array([commodities.index[symbol] for symbol in self.symbols], dtype=np.int32)
+
+        self.taken = time.monotonic()
+        date, account, local, _, _, payee = (np.concatenate(column) for column in zip(*self.chunks))
+        return PostingTable(date, account, ids[local], quantity, self.like.accounts,
+                            commodities, dict(hints), payee,
+                            np.array(tagged, dtype=np.int32).reshape(-1, 3), self.like.names)
+
+class PostingTable:
+    """Postings as parallel arrays of date ordinal, account id, commodity id and
+       quantity, in the order ledger returned them. For filtering, there is
+       also the payee of each posting and the (posting, tag, value) triples of
+       the tags it has, as ids into names (value is -1 if the tag has none).
+       Tables merged from several journals have the source each posting came
+       from (see merge), it is 0 otherwise."""
+    def __init__(self, date, account, commodity, quantity, accounts, commodities,
+                 hints=None, payee=None, tagged=None, names=None, source=None):
+        self.date = date
+        self.account = account
+        self.commodity = commodity
+        self.quantity = quantity
+        self.accounts = accounts
+        self.commodities = commodities
+        # an annotated price per commodity, to help ledger's price lookups
+        self.hints = hints or {}
+
+        self.payee = payee if payee is not None else np.zeros(len(date), dtype=np.int32)
+        self.tagged = tagged if tagged is not None else np.zeros((0, 3), dtype=np.int32)
+        self.names = names if names is not None else Names()
+        self.source = source if source is not None else np.zeros(len(date), dtype=np.int16)
+
+    @classmethod
+    def from_posts(cls, posts, like=None, progress=None, partial=None):
+        """Extracts posts, sharing the side tables of the table like if given.
+           Given like too, partial(table) gets the postings extracted so far
+           every PARTIAL_INTERVAL seconds, without it the side tables are
+           still being filled in."""
+        snapshots = Partial(like) if partial and like is not None else None
+        accounts = like.accounts if like is not None else Accounts()
+        commodities = like.commodities if like is not None else Commodities()
+        names = like.names if like is not None else Names()
+
+        dates, account_ids, symbols, numbers = [], [], [], []
+        payees, tagged = [], []
+        places, hints = {}, {}
+        for row, post in enumerate(posts):
+            amount = post.amount
+            symbol = amount.commodity.symbol
+            number = decimal(amount)
+
+            dates.append(post.date.toordinal())
+            account_ids.append(accounts.add(post.account.fullname()))
+            symbols.append(symbol)
+            numbers.append(number)
+
+            xact = post.xact
+            tags = list(parse_tags(post.note))
+            # a Payee: tag on the posting is what ledger matches payees against
+            payee = next((value for tag, value in reversed(tags) if tag == "Payee" and value),
+                         xact.payee)
+            payees.append(names.add(payee))
+            # posts have the tags of their transaction too
+            for tag, value in chain(parse_tags(xact.note), tags):
+                tagged.append((row, names.add(tag), -1 if value is None else names.add(value)))
+
+            places[symbol] = max(places.get(symbol, 0), -number.as_tuple().exponent)
+            if symbol not in hints and amount.has_annotation() and amount.annotation.price:
+                hints[symbol] = amount.annotation.price.to_fullstring()
+            if not len(dates) % PROGRESS_INTERVAL:
+                if progress:
+                    progress(len(dates))
+                if snapshots and snapshots.due():
+                    partial(snapshots.take(dates, account_ids, symbols, numbers,
+                                           payees, tagged, places, hints))
+
+        ids = {symbol: commodities.add(symbol, places[symbol]) for symbol in places}
+        decimals = commodities.decimals
+        quantity = exact([units(number, decimals[ids[symbol]])
+                          for symbol, number in zip(symbols, numbers)])
+
+        return cls(np.array(dates, dtype=np.int32),
+                   np.array(account_ids, dtype=np.int32),
+                   np.array([ids[symbol] for symbol in symbols], dtype=np.int32),
+                   quantity, accounts, commodities, hints,
+                   np.array(payees, dtype=np.int32),
+                   np.array(tagged, dtype=np.int32).reshape(-1, 3), names)
+
+    def __len__(self):
+        return len(self.date)
+
+    def select(self, mask):
+        """The postings picked by a boolean mask, index array or slice"""
+        rows = np.arange(len(self))[mask]
+        index = np.full(len(self), -1, dtype=np.int32)
+        index[rows] = np.arange(len(rows), dtype=np.int32)
+
+        tagged = self.tagged[index[self.tagged[:, 0]] >= 0]
+        tagged[:, 0] = index[tagged[:, 0]]
+
+        return PostingTable(self.date[rows], self.account[rows],
+                            self.commodity[rows], self.quantity[rows],
+                            self.accounts, self.commodities, self.hints,
+                            self.payee[rows], tagged, self.names, self.source[rows])
+
+    def extend(self, other):
+        """A table with the postings of other (sharing the side tables) after
+           these"""
+        tagged = other.tagged.copy()
+        tagged[:, 0] += len(self)
+        return PostingTable(np.concatenate((self.date, other.date)),
+                            np.concatenate((self.account, other.account)),
+                            np.concatenate((self.commodity, other.commodity)),
+                            exact(np.concatenate((self.quantity, other.quantity))),
+                            self.accounts, self.commodities,
+                            dict(other.hints, **self.hints),
+                            np.concatenate((self.payee, other.payee)),
+                            np.concatenate((self.tagged, tagged)), self.names,
+                            np.concatenate((self.source, other.source)))
+
+    def rebase(self, like):
+        """The same postings using the side tables of the table like, adding
+           what they are missing. Raises ValueError if a commodity has more
+           decimal places here than like stores it with."""
+        commodities = like.commodities.merge(self.commodities)
+        accounts = like.accounts.merge(self.accounts)
+        names = like.names.merge(self.names)
+
+        places = np.array(like.commodities.decimals, dtype=np.int64)[commodities] \
+                - np.array(self.commodities.decimals, dtype=np.int64)
+        quantity = scaled(self.quantity, places[self.commodity])
+
+        tagged = self.tagged.copy()
+        if len(tagged):
+            tagged[:, 1] = names[tagged[:, 1]]
+            tagged[:, 2] = np.where(tagged[:, 2] >= 0, names[tagged[:, 2]], -1)
+
+        return PostingTable(self.date, accounts[self.account],
+                            commodities[self.commodity], quantity,
+                            like.accounts, like.commodities, self.hints,
+                            names[self.payee] if len(self) else self.payee,
+                            tagged, like.names, self.source)
+
+    def amounts(self, quantities=None, commodity=None):
+        """Converts quantities (of the given commodity ids) to numbers"""
+        if quantities is None:
+            quantities, commodity = self.quantity, self.commodity
+        return quantities.astype(np.float64) / self.commodities.scale[commodity]
+
+    def time_series(self, rates=None, merge=None):
+        """Vectorized Journal.time_series: the running total of each commodity,
+           converted using the per-commodity rates if given (and merged into
+           a single series named merge if asked to)
+
+           Returns a dict of symbol -> (dates, totals) and of symbol -> total"""
+        if rates is None:
+            keys, dates, totals = running(self.commodity, self.date, self.quantity)
+            totals = self.amounts(totals, keys)
+        else:
+            values = self.amounts() * rates[self.commodity]
+            keys = np.zeros_like(self.commodity) if merge else self.commodity
+            keys, dates, totals = running(keys, self.date, values)
+
+        symbols = self.commodities.symbols
+        running_total, total = {}, {}
+        for start, end in groups(keys):
+            symbol = merge or symbols[keys[start]]
+            running_total[symbol] = (dates[start:end], totals[start:end])
+            total[symbol] = totals[end-1]
+        return running_total, total
+
+    def account_series(self, aggregated=False, cumulative=True):
+        """Vectorized StatefulAccounts: per account and commodity, the running
+           total (or postings if not cumulative) on each date. The aggregated
+           version has an account's postings counted in all its ancestors too.
+
+           Returns arrays of account ids, commodity ids, dates and quantities"""
+        account, commodity = self.account, self.commodity
+        date, quantity = self.date, self.quantity
+        if aggregated:
+            depth = self.accounts.depth
+            levels = range(int(depth[account].max(initial=0)) + 1)
+            account = np.concatenate([self.accounts.ancestor_at(level)[self.account]
+                                      for level in levels])
+            commodity = np.tile(commodity, len(levels))
+            date = np.tile(date, len(levels))
+            quantity = np.tile(quantity, len(levels))
+
+            # postings to shallower accounts have been counted more than once
+            level = np.repeat(np.arange(len(levels)), len(self))
+            keep = level <= np.tile(depth[self.account], len(levels))
+            account, commodity = account[keep], commodity[keep]
+            date, quantity = date[keep], quantity[keep]
+
+        return self._by_account(account, commodity, date, quantity, cumulative)
+
+    def rollup(self, account, cumulative=True):
+        """Like account_series, with each posting counted towards the account
+           id given for it instead of its own"""
+        return self._by_account(account, self.commodity, self.date, self.quantity, cumulative)
+
+    def _by_account(self, account, commodity, date, quantity, cumulative):
+        keys = account.astype(np.int64) * len(self.commodities) + commodity
+        keys, dates, totals = running(keys, date, quantity, cumulative)
+        accounts, commodities = np.divmod(keys, len(self.commodities))
+        return accounts, commodities, dates, totals
+
+def merge(tables, like=None):
+    """The postings of tables as a single table in date order, on the side
+       tables of like (fresh ones if None) which are added what they are
+       missing, with the position of the table each one came from as its
+       source"""
+    if like is None:
+        # stored with as many places as any of them has
+        places = {}
+        for table in tables:
+            for symbol, decimals in zip(table.commodities.symbols, table.commodities.decimals):
+                places[symbol] = max(decimals, places.get(symbol, 0))
+        like = PostingTable(np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32),
+                            np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int64),
+                            Accounts(), Commodities(places, places.values()))
+    merged = like.select(slice(0))
+    for source, table in enumerate(tables):
+        table = table.rebase(like)
+        table.source = np.full(len(table), source, dtype=np.int16)
+        merged = merged.extend(table)
+    return merged.select(np.argsort(merged.date, kind="stable"))
+
+def groups(keys):
+    """Yields (start, end) of each run of equal keys"""
+    if not len(keys):
+        return
+    bounds = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+    yield from zip(np.r_[0, bounds], np.r_[bounds, len(keys)])
+
+def downsample(dates, values, buckets, begin=None, end=None):
+    """Indices of the points of a line worth drawing at a resolution of
+       buckets between begin and end: the first, last, lowest and highest in
+       each bucket, plus the point just outside on either side"""
+    lo = 0 if begin is None else max(np.searchsorted(dates, begin) - 1, 0)
+    hi = len(dates) if end is None else min(np.searchsorted(dates, end, side="right") + 1, len(dates))
+    if hi - lo <= 4 * buckets:
+        return np.arange(lo, hi)
+
+    dates, values = dates[lo:hi], values[lo:hi]
+    span = int(dates[-1]) - int(dates[0]) + 1
+    bucket = (dates - dates[0]).astype(np.int64) * buckets // span
+
+    # dates are sorted so the buckets come in runs, lexsort keeps them where
+    # they are and orders each one by value
+    order = np.lexsort((values, bucket))
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    ends = np.r_[starts[1:], len(bucket)] - 1
+    keep = np.concatenate([starts, ends, order[starts], order[ends]])
+    return lo + np.unique(keep)
+
+# roughly how many days each period lasts
+PERIODS = {"day": 1, "week": 7, "month": 30, "quarter": 91, "year": 365}
+
+def period_starts(dates, period, first_month=1):
+    """The date ordinal each of dates' period starts on, weeks start on
+       Mondays and quarters and (fiscal) years in first_month"""
+    dates = np.asarray(dates, dtype=np.int64)
+    if period == "day":
+        return dates
+    if period == "week":
+        # ordinal 1 is a Monday
+        return dates - (dates - 1) % 7
+    if period not in PERIODS:
+        raise ValueError("Unknown period: " + period)
+
+    months = to_datetime64(dates).astype('datetime64[M]').astype(np.int64)
+    if period != "month":
+        length = 3 if period == "quarter" else 12
+        shifted = months - (first_month - 1)
+        months = shifted - shifted % length + (first_month - 1)
+    return months.astype('datetime64[M]').astype('datetime64[D]').astype(np.int64) + EPOCH
+
+def period_sums(keys, periods, values):
+    """Sums values by key and period, returning the keys, periods and sums
+       ordered by period then key"""
+    if not len(keys):
+        return keys, periods, values
+    order = np.lexsort((keys, periods))
+    keys, periods, values = keys[order], periods[order], values[order]
+    starts = np.flatnonzero(np.r_[True, (keys[1:] != keys[:-1]) | (periods[1:] != periods[:-1])])
+    return keys[starts], periods[starts], np.add.reduceat(values, starts)
+
+def stack(periods, values):
+    """Where the bars of values (ordered by period, then by how they should
+       be stacked) start, positive ones stacked up from zero and negative
+       ones stacked just the same, by size, the first on top"""
+    negative = values < 0
+    first = np.flatnonzero(np.r_[True, periods[1:] != periods[:-1]])
+    lengths = np.diff(np.r_[first, len(periods)])
+
+    def within(x):
+        """running total of x restarting with each period"""
+        totals = np.cumsum(x)
+        return totals - np.repeat(totals[first] - x[first], lengths)
+
+    positive = np.where(negative, 0, values)
+    sizes = np.where(negative, -values, 0)
+    below = within(positive) - positive
+    above = within(sizes)
+    period_total = np.repeat(above[np.r_[first[1:], len(periods)] - 1], lengths)
+    return np.where(negative, period_total - above, below)
+
+if os.environ.get("LEDGER_THREADS"):
+    parallel(int(os.environ["LEDGER_THREADS"]) if os.environ["LEDGER_THREADS"].isdigit() else None)
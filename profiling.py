@@ -0,0 +1,104 @@
+"""Spans timing what the application spends its time on, along with counts
+of what they processed (postings, points plotted...). While profiling is off
+a span costs a function call and a check.
+
+Setting LEDGER_PROFILE turns it on from the start, if it names a .json file
+the spans are written there as a Chrome trace on exit."""
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+enabled = bool(os.environ.get("LEDGER_PROFILE"))
+
+# finished spans as (name, thread, start, duration, counts), times in ns
+spans = deque(maxlen=100000)
+local = threading.local()
+
+class Span:
+    __slots__ = ("name", "counts", "start")
+
+    def __init__(self, name):
+        self.name = name
+        self.counts = {}
+
+    def __enter__(self):
+        stack = local.__dict__.setdefault("stack", [])
+        stack.append(self)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        duration = time.perf_counter_ns() - self.start
+        local.stack.pop()
+        spans.append((self.name, threading.get_ident(), self.start, duration, self.counts))
+        return False
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL = NullSpan()
+
+def enable(on=True):
+    global enabled
+    enabled = bool(on)
+
+def span(name):
+    """Context manager timing what runs inside it"""
+    return Span(name) if enabled else NULL
+
+def timed(name=None):
+    """Decorator putting every call to the function in a span, named after
+       it unless given a name"""
+    def decorate(function):
+        label = name or function.__qualname__
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            with Span(label):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def record(name, start, duration, **counts):
+    """Adds a span timed some other way, whether profiling is on or not"""
+    spans.append((name, threading.get_ident(), start, duration, counts))
+
+def count(**counts):
+    """Adds to the counts of the innermost span open on this thread"""
+    if not enabled:
+        return
+    stack = getattr(local, "stack", None)
+    if stack:
+        totals = stack[-1].counts
+        for key, value in counts.items():
+            totals[key] = totals.get(key, 0) + value
+
+def summary():
+    """{name: (calls, total ns, last ns, counts of the last call)} of the spans
+       recorded so far"""
+    result = {}
+    for name, _, _, duration, counts in list(spans):
+        calls, total, _, _ = result.get(name, (0, 0, 0, None))
+        result[name] = (calls + 1, total + duration, duration, counts)
+    return result
+
+def export(filename):
+    """Writes the spans as a Chrome trace (chrome://tracing, Perfetto)"""
+    pid = os.getpid()
+    events = [{"name": name, "ph": "X", "pid": pid, "tid": thread,
+               "ts": start / 1000, "dur": duration / 1000, "args": counts}
+              for name, thread, start, duration, counts in list(spans)]
+    with open(filename, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+if os.environ.get("LEDGER_PROFILE", "").endswith(".json"):
+    atexit.register(export, os.environ["LEDGER_PROFILE"])
@@ -0,0 +1,219 @@
+"""Evaluates the common subset of ledger's query language over a PostingTable,
+for everything else ledger has to run the query itself."""
+import re
+from datetime import date
+
+import numpy as np
+
+class Unsupported(Exception):
+    pass
+
+KEYWORDS = {
+    "and": "and", "&": "and",
+    "or": "or", "|": "or",
+    "not": "not", "!": "not",
+    "(": "(", ")": ")",
+}
+# query terms that only ledger knows how to evaluate
+UNSUPPORTED = {"expr", "note", "code", "show", "only", "bold", "for", "since", "until"}
+PREFIXES = {"@": "payee", "%": "tag", "=": "note", "#": "code"}
+OPTIONS = {"-b": "begin", "--begin": "begin", "-e": "end", "--end": "end",
+           "-p": "period", "--period": "period"}
+
+WORD = re.compile(r"[^\s()&|]+")
+ARGUMENT = re.compile(r"\s*(\S+)")
+DATE = re.compile(r"^(\d{4})(?:[-/.](\d{1,2})(?:[-/.](\d{1,2}))?)?$")
+
+def tokenize(text):
+    """Yields (kind, value) pairs, kind is one of the KEYWORDS, "term" or an
+       option name"""
+    i = 0
+    while i < len(text):
+        c = text[i]
+        if c.isspace():
+            i += 1
+        elif c in "()&|!":
+            yield KEYWORDS[c], c
+            i += 1
+        elif c in "'\"":
+            end = text.find(c, i + 1)
+            if end < 0:
+                raise Unsupported("unterminated quote")
+            yield "term", text[i+1:end]
+            i = end + 1
+        else:
+            match = WORD.match(text, i)
+            word = match.group()
+            i = match.end()
+
+            option, _, argument = word.partition("=")
+            if word.startswith("-"):
+                if option not in OPTIONS:
+                    raise Unsupported(word)
+                if not argument:
+                    match = ARGUMENT.match(text, i)
+                    if not match:
+                        raise Unsupported(word)
+                    argument = match.group(1)
+                    i = match.end()
+                yield OPTIONS[option], argument
+            elif word.lower() in KEYWORDS:
+                yield KEYWORDS[word.lower()], word
+            else:
+                yield "term", word
+
+def period(text):
+    """(begin, end) date ordinals of the year, month or day text names"""
+    match = DATE.match(text)
+    if not match:
+        raise Unsupported(text)
+    year, month, day = (int(x) if x else None for x in match.groups())
+
+    begin = date(year, month or 1, day or 1)
+    if day:
+        end = date.fromordinal(begin.toordinal() + 1)
+    elif month:
+        end = date(year + month // 12, month % 12 + 1, 1)
+    else:
+        end = date(year + 1, 1, 1)
+    return begin.toordinal(), end.toordinal()
+
+def regex(pattern):
+    try:
+        return re.compile(pattern, re.IGNORECASE)
+    except re.error:
+        raise Unsupported(pattern)
+
+def matching(names, pattern):
+    """Boolean array of which names match pattern"""
+    return np.fromiter((bool(pattern.search(name)) for name in names),
+                       dtype=bool, count=len(names))
+
+class Parser:
+    """Builds a function of a PostingTable returning the mask of the postings
+       the query selects"""
+    def __init__(self, text):
+        self.tokens = list(tokenize(text))
+        self.dates = []
+
+    def peek(self):
+        return self.tokens[0][0] if self.tokens else None
+
+    def next(self):
+        return self.tokens.pop(0)
+
+    def parse(self):
+        # options can appear anywhere and apply to the whole query
+        tokens, self.tokens = self.tokens, []
+        for kind, value in tokens:
+            if kind in ("begin", "end", "period"):
+                self.dates.append((kind, period(value)))
+            else:
+                self.tokens.append((kind, value))
+
+        query = self.query() if self.tokens else None
+        if self.tokens:
+            raise Unsupported(self.tokens[0][1])
+
+        dates = self.dates
+        def evaluate(table):
+            mask = query(table) if query else np.ones(len(table), dtype=bool)
+            for kind, (begin, end) in dates:
+                if kind in ("begin", "period"):
+                    mask &= table.date >= begin
+                if kind == "end":
+                    mask &= table.date < begin
+                if kind == "period":
+                    mask &= table.date < end
+            return mask
+        return evaluate
+
+    def query(self):
+        # terms next to each other are or-ed together
+        terms = [self.or_expr()]
+        while self.peek() in ("term", "not", "("):
+            terms.append(self.or_expr())
+        return combine(terms, np.logical_or)
+
+    def or_expr(self):
+        terms = [self.and_expr()]
+        while self.peek() == "or":
+            self.next()
+            terms.append(self.and_expr())
+        return combine(terms, np.logical_or)
+
+    def and_expr(self):
+        terms = [self.unary()]
+        while self.peek() == "and":
+            self.next()
+            terms.append(self.unary())
+        return combine(terms, np.logical_and)
+
+    def unary(self):
+        if self.peek() == "not":
+            self.next()
+            term = self.unary()
+            return lambda table: ~term(table)
+        return self.primary()
+
+    def primary(self):
+        if not self.tokens:
+            raise Unsupported("incomplete query")
+        kind, value = self.next()
+        if kind == "(":
+            query = self.query()
+            if self.peek() != ")":
+                raise Unsupported("unbalanced parentheses")
+            self.next()
+            return query
+        if kind != "term":
+            raise Unsupported(value)
+
+        field = "account"
+        if value.lower() in ("payee", "desc", "tag", "account") or value.lower() in UNSUPPORTED:
+            field = value.lower()
+            if not self.tokens or self.peek() != "term":
+                raise Unsupported(value)
+            _, value = self.next()
+        elif value[0] in PREFIXES and len(value) > 1:
+            field, value = PREFIXES[value[0]], value[1:]
+
+        if field == "account":
+            pattern = regex(value)
+            return lambda table: matching(table.accounts.names, pattern)[table.account]
+        if field in ("payee", "desc"):
+            pattern = regex(value)
+            return lambda table: matching(table.names.names, pattern)[table.payee]
+        if field == "tag":
+            name, _, value = value.partition("=")
+            return tag(regex(name), value and regex(value))
+        raise Unsupported(field)
+
+def combine(terms, operator):
+    if len(terms) == 1:
+        return terms[0]
+    def evaluate(table):
+        mask = terms[0](table)
+        for term in terms[1:]:
+            mask = operator(mask, term(table))
+        return mask
+    return evaluate
+
+def tag(name, value=None):
+    def evaluate(table):
+        names = table.names.names
+        tagged = table.tagged
+        hit = matching(names, name)[tagged[:, 1]]
+        if value:
+            has_value = tagged[:, 2] >= 0
+            hit &= has_value & matching(names, value)[np.maximum(tagged[:, 2], 0)]
+
+        mask = np.zeros(len(table), dtype=bool)
+        mask[tagged[hit, 0]] = True
+        return mask
+    return evaluate
+
+def evaluate(text, table):
+    """The mask of the postings in table that the query text selects, raises
+       Unsupported if ledger has to be asked instead"""
+    return Parser(text).parse()(table)
@@ -0,0 +1,156 @@
+"""A journal served by server.py, standing in for datasource.Journal in the
+visualizer's tabs. Responses are kept along with their ETag and only
+downloaded again once the server has something new."""
+import gzip
+import json
+from collections import OrderedDict
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+import numpy as np
+
+class RemoteJournal:
+    def __init__(self, url, effective_date=True, progress=None, cache_size=64):
+        self.filename = url
+        self.url = url.rstrip("/")
+        self.effective_date = bool(effective_date)
+
+        self.cache_size = cache_size
+        self.responses = OrderedDict()
+        self.info = self.get("/info")
+
+    def get(self, path, effective=None, **query):
+        """The decoded response to a query, RuntimeError if the server could
+           not answer it"""
+        query["effective"] = int(self.effective_date if effective is None else effective)
+        url = "{}{}?{}".format(self.url, path, urlencode(sorted(query.items())))
+        request = Request(url, headers={"Accept-Encoding": "gzip"})
+        cached = self.responses.get(url)
+        if cached:
+            request.add_header("If-None-Match", cached[0])
+
+        try:
+            with urlopen(request) as response:
+                body = response.read()
+                if response.headers.get("Content-Encoding") == "gzip":
+                    body = gzip.decompress(body)
+                etag = response.headers.get("ETag")
+        except HTTPError as e:
+            if e.code == 304 and cached:
+                self.responses.move_to_end(url)
+                return cached[1]
+            try:
+                message = json.loads(e.read())["error"]
+            except ValueError:
+                message = str(e)
+            raise RuntimeError(message)
+
+        result = json.loads(body)
+        if etag:
+            self.responses[url] = etag, result
+            while len(self.responses) > self.cache_size:
+                self.responses.popitem(last=False)
+        return result
+
+    @property
+    def symbols(self):
+        return self.info["symbols"]
+
+    @property
+    def sources(self):
+        return [self.filename]
+
+    def precision(self, symbol):
+        return self.info["precisions"].get(symbol, 0)
+
+    def set_effective_date(self, effective_date):
+        self.effective_date = bool(effective_date)
+
+    def refresh(self, progress=None):
+        """Whether the journal changed on the server since last asked"""
+        info = self.get("/info")
+        changed = info["version"] != self.info["version"]
+        self.info = info
+        return changed
+
+    def time_series(self, filter, show_currency=None, merge=False, progress=None,
+                    partial=None, source=None, effective=None):
+        result = self.get("/time_series", effective, filter=filter, commodity=show_currency or "",
+                          merge=int(bool(merge)))
+        running_total = {symbol: (np.array(dates, dtype=np.int32), np.array(totals))
+                         for symbol, (dates, totals) in result["series"].items()}
+        return running_total, result["total"]
+
+    def account_series(self, filter, progress=None, partial=None, source=None, effective=None,
+                       commodity=None):
+        return RemoteAccounts(self, filter, effective)
+
+class RemoteAccounts:
+    """What the tabs use of StatefulAccounts, fetched when first asked for or
+       up front by prefetch()"""
+    def __init__(self, journal, filter, effective=None):
+        self.source = journal
+        self.filter = filter
+        self.effective = journal.effective_date if effective is None else bool(effective)
+        self.derived = {}
+
+    def get(self, path, **query):
+        return self.source.get(path, self.effective, filter=self.filter, **query)
+
+    @property
+    def names(self):
+        if "names" not in self.derived:
+            self.derived["names"] = self.get("/names")
+        return self.derived["names"]
+
+    @property
+    def max_depth(self):
+        # of all the accounts, the server's is never more than this
+        return max((name.count(":") + 1 for name in self.names[1:]), default=0)
+
+    def prefetch(self, commodity, cumulative=(), totals=False):
+        """Fetches the names and what valued() for each of cumulative and
+           account_totals() if asked to return for commodity at every depth
+           limit, so that the redraws need not (they are on the GUI thread).
+           Returns self."""
+        self.names
+        if commodity:
+            for limit in range(max(self.max_depth, 1)):
+                for each in cumulative:
+                    self.valued(limit, commodity, each)
+                if totals:
+                    self.account_totals(limit, commodity)
+        return self
+
+    def valued(self, limit, commodity, cumulative=True):
+        if limit >= self.max_depth:
+            limit = 0
+        key = ("valued", limit, commodity, cumulative)
+        if key not in self.derived:
+            result = self.get("/accounts", commodity=commodity, depth=limit,
+                              cumulative=int(cumulative))
+            self.derived[key] = [(name, total, np.array(dates, dtype=np.int32), np.array(values))
+                                 for name, total, dates, values in result]
+        return self.derived[key]
+
+    def account_totals(self, limit, commodity, account=""):
+        names = self.names
+        if account:
+            if account not in names:
+                return np.zeros(0, dtype=np.int64), np.zeros(0)
+            limit = limit and account.count(":") + 1 + limit
+        if limit >= self.max_depth:
+            limit = 0
+        key = ("account_totals", limit, commodity)
+        if key not in self.derived:
+            result = self.get("/totals", commodity=commodity, depth=limit)
+            self.derived[key] = (np.array(result["ids"], dtype=np.int64),
+                                 np.array(result["values"], dtype=np.float64))
+        ids, values = self.derived[key]
+
+        if account:
+            below = np.array([names[id] == account or names[id].startswith(account + ":")
+                              for id in ids.tolist()], dtype=bool)
+            ids, values = ids[below], values[below]
+        return ids, values
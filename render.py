@@ -0,0 +1,194 @@
+"""What each of the tabs shows, worked out from a Journal as plain data so the
+same plots can be drawn on screen or rendered to a file"""
+import os
+
+import numpy as np
+from matplotlib import colormaps
+
+from postings import (
+        PERIODS, downsample, groups, period_starts, period_sums, stack, to_datetime64,
+)
+
+cmap = colormaps['gist_ncar']
+
+KINDS = ("time_series", "accounts", "bars", "pie")
+
+def label(name, total, symbol, precision):
+    return ("%s (%." + str(precision) + "f %s)") % (name, total, symbol)
+
+def time_series_lines(journal, running_total, total, commodity=""):
+    """(key, dates, values, properties) of each commodity's running total as
+       returned by Journal.time_series, the biggest first"""
+    count = len(total)
+    colors = map(cmap, ((x+0.5)/count for x in range(count)))
+
+    lines = []
+    for color, (symbol, amount) in zip(colors, sorted(total.items(), key=lambda x: x[1], reverse=True)):
+        dates, totals = running_total[symbol]
+        shown = commodity or symbol
+        text = label(symbol, amount, shown, journal.precision(shown))
+        lines.append((symbol, dates, totals, dict(color=color, label=text)))
+    return lines
+
+# what tells apart the lines of each journal overlaid, as matplotlib dashes
+DASHES = (None, (6, 3), (1, 2), (6, 2, 1, 2))
+
+def overlay(sources, lines):
+    """The lines of each source (a list of what the functions here return per
+       source) as one list, keyed by (source, key) and told apart by dashes.
+       Just the one source's lines are returned as they are."""
+    if len(lines) == 1:
+        return lines[0]
+    overlaid = []
+    for source, (name, shown) in enumerate(zip(sources, lines)):
+        dashes = DASHES[source % len(DASHES)]
+        for key, dates, values, properties in shown:
+            properties = dict(properties)
+            if dashes:
+                properties["dashes"] = dashes
+            if "label" in properties:
+                properties["label"] += " " + os.path.basename(name)
+            overlaid.append(((source, key), dates, values, properties))
+    return overlaid
+
+def account_lines(journal, series, limit, commodity):
+    """(key, dates, values, properties) of each account's running total in
+       commodity, accounts below limit are rolled up into their parent"""
+    accounts = series.valued(limit, commodity) if series and commodity else []
+    precision = journal.precision(commodity) if accounts else 0
+    colors = map(cmap, ((x+0.5)/len(accounts) for x in range(len(accounts))))
+
+    return [(name, dates, values, dict(label=label(name, total, commodity, precision), color=color))
+            for color, (name, total, dates, values) in zip(colors, accounts)]
+
+def bar_width(period):
+    """Width in days of the bars for period, a third of its length"""
+    return PERIODS[period] / 3
+
+def period_totals(series, limit, commodity, period="month", first_month=1):
+    """(valued, index, starts, sums): how much each account of series.valued()
+       changed per period, as positions into valued, period starts and sums"""
+    valued = []
+    if series and commodity:
+        valued = series.valued(limit, commodity, cumulative=False)
+    if not valued:
+        return valued, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int32), np.zeros(0)
+
+    index = np.repeat(np.arange(len(valued)), [len(dates) for _, _, dates, _ in valued])
+    dates = np.concatenate([dates for _, _, dates, _ in valued])
+    values = np.concatenate([values for _, _, _, values in valued])
+    index, starts, sums = period_sums(index, period_starts(dates, period, first_month), values)
+    return valued, index, starts, sums
+
+def bars(journal, series, limit, commodity, period="month", first_month=1):
+    """(key, x, height, bottom, properties) of the bars showing how much each
+       account changed per period (see postings.period_starts), incomes and
+       expenses are stacked next to each other"""
+    valued, index, starts, sums = period_totals(series, limit, commodity, period, first_month)
+    if not valued:
+        return []
+    precision = journal.precision(commodity)
+    bottoms = stack(starts, sums)
+    negative = sums < 0
+    heights = np.abs(sums)
+
+    # the positive bar just before the start of the period, the negative one after
+    width = bar_width(period)
+    shift = np.where(negative, width / 2, -width / 2) * 86400
+    x = to_datetime64(starts).astype('datetime64[s]') + shift.astype('timedelta64[s]')
+
+    order = np.lexsort((starts, negative, index))
+    index, negative, x, heights, bottoms = (
+            index[order], negative[order], x[order], heights[order], bottoms[order])
+
+    plotted = []
+    for first, last in groups(index):
+        i = index[first]
+        name, total, _, _ = valued[i]
+        properties = dict(color=cmap((i+0.5)/len(valued)))
+        split = first + np.searchsorted(negative[first:last], True)
+        plotted.append(((name, False), x[first:split], heights[first:split], bottoms[first:split],
+                        dict(properties, label=label(name, total, commodity, precision))))
+        plotted.append(((name, True), x[split:last], heights[split:last], bottoms[split:last],
+                        properties))
+    return plotted
+
+def wedges(sizes, threshold=0.01):
+    """Positions of the sizes that get a wedge of their own, largest first:
+       as long as the next one would be at least threshold of the total of
+       those before it. Past 1/threshold + 1 of them, the next one never is,
+       so only that many need sorting."""
+    count = min(len(sizes), int(np.ceil(1 / threshold)) + 2)
+    top = np.argpartition(-sizes, count - 1)[:count] if count < len(sizes) else np.arange(len(sizes))
+    top = top[np.argsort(-sizes[top], kind="stable")]
+
+    before = np.cumsum(sizes[top]) - sizes[top]
+    small = np.flatnonzero((before > 0) & (sizes[top] < threshold * before))
+    # a long tail of one is just that one
+    if len(small) and small[0] < len(sizes) - 1:
+        return top[:small[0]]
+    return top
+
+def pie(series, limit, commodity, account="", threshold=0.01):
+    """(sizes, labels, colors) of the accounts' share of the total, only
+       account and those below it if given, None if there is nothing to show"""
+    if not series or not commodity:
+        return None
+    ids, values = series.account_totals(limit, commodity, account)
+    if not len(ids):
+        return None
+
+    sizes = np.abs(values)
+    total = sizes.sum()
+    shown = wedges(sizes, threshold)
+    names = series.names
+    out = [(sizes[i], names[ids[i]]) for i in shown.tolist()]
+    if len(shown) < len(sizes):
+        rest = len(sizes) - len(shown)
+        out.append((total - sizes[shown].sum(),
+                    'long tail of {} below {:.2%}'.format(rest, threshold)))
+    if total:
+        out = [(size, "{} ({:.2%})".format(name, size / total)) for size, name in out]
+
+    # the graph gets drawn counter-clockwise, reverse to get it clockwise
+    sizes, labels = zip(*reversed(out))
+    colors = map(cmap, (1 - float(x)/len(sizes) for x in range(len(sizes))))
+    return sizes, labels, list(colors)
+
+def draw(ax, journal, kind, filter="", commodity="", limit=0, merge=False,
+         period="month", first_month=1, overlaid=False):
+    """Plots what the tab for kind would show onto ax, overlaid has a line
+       of its own for each of the journals merged"""
+    ax.grid(kind != "pie")
+    lines = None
+    sources = range(len(journal.sources)) if overlaid and len(journal.sources) > 1 else [None]
+    if kind == "time_series":
+        lines = [time_series_lines(journal, *journal.time_series(
+                        filter, commodity, bool(commodity and merge), source=source), commodity)
+                 for source in sources]
+    elif kind == "accounts":
+        lines = [account_lines(journal, journal.account_series(filter, source=source), limit, commodity)
+                 for source in sources]
+    elif kind == "bars":
+        for key, x, height, bottom, properties in bars(
+                journal, journal.account_series(filter), limit, commodity, period, first_month):
+            ax.bar(x, height, bar_width(period), bottom=bottom, **properties)
+    elif kind == "pie":
+        shares = pie(journal.account_series(filter) if commodity else None, limit, commodity)
+        if shares:
+            sizes, labels, colors = shares
+            ax.pie(sizes, labels=labels, colors=colors, startangle=90)
+        return
+    else:
+        raise ValueError("Unknown kind of plot: " + kind)
+    if lines:
+        lines = overlay(journal.sources, lines)
+
+    if commodity:
+        ax.set_ylabel(commodity)
+    if lines:
+        resolution = max(int(ax.bbox.width), 1)
+        for key, dates, values, properties in lines:
+            shown = downsample(dates, values, resolution)
+            ax.plot_date(to_datetime64(dates[shown]), values[shown], fmt='o-', **properties)
+        ax.legend(loc='upper left')
@@ -0,0 +1,74 @@
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+import profiling
+
+class State:
+    """What the tabs show: the journal, filter, commodity shown in terms of,
+       whether to merge commodities, use effective dates and overlay the
+       journals merged, and the account depth"""
+    # what has the tabs compute everything again rather than just redraw
+    RESET = ("journal", "filter", "commodity", "merge", "effective", "overlay")
+
+    def __init__(self):
+        self.journal = None
+        self.filter = ""
+        self.commodity = ""
+        self.merge = False
+        self.effective = False
+        self.overlay = False
+        self.depth = 0
+
+class Scheduler(QObject):
+    """Sits between the options and the tabs. The options tell it what
+       changed, the tabs are then told to reset or redraw once the event loop
+       comes round, however many changes came in the meantime."""
+    reset = pyqtSignal()
+    redraw = pyqtSignal()
+
+    def __init__(self, parent=None):
+        super(Scheduler, self).__init__(parent)
+        self.state = State()
+        self.dirty = set()
+
+        # how many changes came in and how many resets or redraws they took
+        self.requested = 0
+        self.performed = 0
+
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(0)
+        self.timer.timeout.connect(self.flush)
+
+    @property
+    def saved(self):
+        return self.requested - self.performed
+
+    def update(self, **changes):
+        """Sets parts of the state, the tabs hear about it unless they were
+           already like that"""
+        self.requested += 1
+        for name, value in changes.items():
+            if getattr(self.state, name) != value:
+                setattr(self.state, name, value)
+                self.dirty.add(name)
+        if self.dirty:
+            self.timer.start()
+
+    def invalidate(self):
+        """The journal changed under the same state"""
+        self.requested += 1
+        self.dirty.add("journal")
+        self.timer.start()
+
+    def flush(self):
+        dirty, self.dirty = self.dirty, set()
+        state = self.state
+        if not dirty or state.journal is None:
+            return
+        self.performed += 1
+        with profiling.span("Scheduler.flush"):
+            profiling.count(requested=self.requested, saved=self.saved)
+            if dirty.intersection(State.RESET):
+                self.reset.emit()
+            else:
+                self.redraw.emit()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""Serves what the visualizer shows of a journal as JSON over HTTP, so that
+it is only loaded and aggregated once for everyone looking at it. app.py
+opens an http:// address given instead of a file as a client of the server.
+
+    GET /info           symbols and their display precisions
+    GET /time_series    ?filter=&commodity=&merge=
+    GET /accounts       ?filter=&commodity=&depth=&cumulative=
+    GET /totals         ?filter=&commodity=&depth=&account=
+    GET /names          ?filter=
+    GET /bars           ?filter=&commodity=&depth=&period=&first_month=
+
+They all take effective=1 for effective dates. Every response has an ETag,
+asking again with If-None-Match gets a 304 until the journal changes."""
+import argparse
+import gzip
+import hashlib
+import json
+import sys
+import time
+import traceback
+from collections import OrderedDict
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# how often to check whether the journal files changed, in seconds
+REFRESH_INTERVAL = 1
+# responses bigger than this are compressed for clients that accept it
+COMPRESS_SIZE = 1024
+
+class NotFound(Exception):
+    pass
+
+def flag(query, name):
+    return query.get(name, "") in ("1", "true", "yes")
+
+class Aggregates:
+    """The journal and the responses worked out from it so far"""
+    def __init__(self, journal, cache_size=256):
+        self.journal = journal
+        self.version = 0
+        self.checked = time.monotonic()
+
+        self.cache_size = cache_size
+        self.responses = OrderedDict()
+
+    def warm(self):
+        """Works out the unfiltered series everything else starts from"""
+        from datasource import lock
+        with lock:
+            for effective in (False, True):
+                self.journal.time_series("", effective=effective)
+                self.journal.account_series("", effective=effective)
+
+    def refresh(self):
+        if time.monotonic() - self.checked < REFRESH_INTERVAL:
+            return
+        self.checked = time.monotonic()
+        if self.journal.refresh():
+            self.version += 1
+            self.responses.clear()
+
+    def respond(self, path, query):
+        """(etag, body, compressed body or None) of the response to a query"""
+        from datasource import lock
+        with lock:
+            self.refresh()
+            key = (path, tuple(sorted(query.items())))
+            if key in self.responses:
+                self.responses.move_to_end(key)
+                return self.responses[key]
+
+            body = json.dumps(self.compute(path, query)).encode()
+            etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+            compressed = gzip.compress(body) if len(body) > COMPRESS_SIZE else None
+            response = self.responses[key] = etag, body, compressed
+            while len(self.responses) > self.cache_size:
+                self.responses.popitem(last=False)
+            return response
+
+    def compute(self, path, query):
+        journal = self.journal
+        effective = flag(query, "effective")
+        filter = query.get("filter", "")
+        commodity = query.get("commodity", "")
+        depth = int(query.get("depth", 0))
+
+        if path == "/info":
+            symbols = journal.symbols
+            return {"file": journal.filename, "version": self.version, "symbols": symbols,
+                    "precisions": {symbol: journal.precision(symbol) for symbol in symbols}}
+        if path == "/time_series":
+            running_total, total = journal.time_series(filter, commodity, flag(query, "merge"),
+                                                  effective=effective)
+            return {"series": {symbol: [dates.tolist(), totals.tolist()]
+                               for symbol, (dates, totals) in running_total.items()},
+                    "total": {symbol: float(amount) for symbol, amount in total.items()}}
+
+        series = journal.account_series(filter, effective=effective)
+        if path == "/names":
+            return series.names
+        if path == "/accounts":
+            valued = series.valued(depth, commodity, flag(query, "cumulative")) if commodity else []
+            return [[name, float(total), dates.tolist(), values.tolist()]
+                    for name, total, dates, values in valued]
+        if path == "/totals":
+            ids, values = series.account_totals(depth, commodity, query.get("account", ""))
+            return {"ids": ids.tolist(), "values": values.tolist()}
+        if path == "/bars":
+            import render
+            bars = render.bars(journal, series, depth, commodity, query.get("period", "month"),
+                               int(query.get("first_month", 1)))
+            return [[list(key), x.astype(str).tolist(), height.tolist(), bottom.tolist(), properties]
+                    for key, x, height, bottom, properties in bars]
+        raise NotFound(path)
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = {name: values[-1] for name, values in
+                 parse_qs(url.query, keep_blank_values=True).items()}
+        try:
+            etag, body, compressed = self.server.aggregates.respond(url.path, query)
+        except NotFound:
+            return self.fail(HTTPStatus.NOT_FOUND, "No such thing: " + url.path)
+        except (ValueError, RuntimeError) as e:
+            return self.fail(HTTPStatus.BAD_REQUEST, "{}: {}".format(type(e).__name__, e))
+        except Exception as e:
+            traceback.print_exc()
+            return self.fail(HTTPStatus.INTERNAL_SERVER_ERROR, "{}: {}".format(type(e).__name__, e))
+
+        if etag in self.headers.get("If-None-Match", ""):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("ETag", etag)
+        # always check back, the journal could have changed
+        self.send_header("Cache-Control", "no-cache")
+        if compressed and "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = compressed
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def fail(self, status, message):
+        body = json.dumps({"error": message}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super(Handler, self).log_message(format, *args)
+
+def serve(journal, host="127.0.0.1", port=8000, quiet=False):
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.aggregates = Aggregates(journal)
+    server.quiet = quiet
+    return server
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("journal")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="address to listen on, only this machine by default")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--quiet", action="store_true", help="do not log every request")
+    args = parser.parse_args(argv)
+
+    from datasource import Journal
+    server = serve(Journal(args.journal), args.host, args.port, args.quiet)
+    server.aggregates.warm()
+    host, port = server.server_address[:2]
+    print("Serving {} on http://{}:{}/".format(args.journal, host, port), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""Writes made up ledger journals of a given shape, always the same one for
+the same parameters and seed, for benchmarking"""
+import argparse
+import random
+import string
+import sys
+from datetime import date, timedelta
+from itertools import product
+
+BASE = "EUR"
+CURRENCIES = ["EUR", "USD", "GBP", "CHF", "JPY"]
+ROOTS = ["Assets", "Expenses", "Income", "Liabilities"]
+
+def symbols(count):
+    """count commodity symbols, the first of them BASE"""
+    letters = ("".join(x) for x in product(string.ascii_uppercase, repeat=3))
+    extra = (symbol for symbol in letters if symbol not in CURRENCIES)
+    return (CURRENCIES + [next(extra) for _ in range(max(count - len(CURRENCIES), 0))])[:count]
+
+def accounts(depth, breadth):
+    """Every account of a tree breadth wide and depth deep under each root"""
+    names = []
+    level = list(ROOTS)
+    for _ in range(depth - 1):
+        level = ["{}:{}{}".format(parent, parent.rsplit(":", 1)[-1][:3], i)
+                 for parent in level for i in range(breadth)]
+    names.extend(level)
+    return names
+
+def generate(out, postings=10000, depth=3, breadth=4, commodities=3,
+             prices_per_year=12, years=5, payees=50, seed=0):
+    """Writes a journal of about postings postings (two per transaction)
+       spread over years, between accounts depth deep with breadth children
+       each, in commodities commodities which have prices_per_year prices
+       against the first one"""
+    rng = random.Random(seed)
+    start = date(2000, 1, 1)
+    days = 365 * years
+    names = accounts(depth, breadth)
+    held = symbols(commodities)
+
+    for symbol in held[1:]:
+        rate = rng.uniform(0.5, 2)
+        for _ in range(prices_per_year * years):
+            rate *= rng.uniform(0.95, 1.05)
+            when = start + timedelta(rng.randrange(days))
+            out.write("P {} {} {:.4f} {}\n".format(when, symbol, rate, BASE))
+    out.write("\n")
+
+    transactions = max(postings // 2, 1)
+    for i in range(transactions):
+        when = start + timedelta(days * i // transactions)
+        source, target = rng.sample(names, 2)
+        symbol = rng.choice(held)
+        note = "  ; :tag{}:".format(rng.randrange(5)) if rng.random() < 0.1 else ""
+        out.write("{} Payee {}{}\n".format(when, rng.randrange(payees), note))
+        out.write("    {}  {:.2f} {}\n".format(target, rng.uniform(1, 1000), symbol))
+        out.write("    {}\n\n".format(source))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("output", nargs="?", help="defaults to standard output")
+    parser.add_argument("--postings", type=int, default=10000)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--breadth", type=int, default=4)
+    parser.add_argument("--commodities", type=int, default=3)
+    parser.add_argument("--prices-per-year", type=int, default=12)
+    parser.add_argument("--years", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    parameters = dict(postings=args.postings, depth=args.depth, breadth=args.breadth,
+                      commodities=args.commodities, prices_per_year=args.prices_per_year,
+                      years=args.years, seed=args.seed)
+    if args.output:
+        with open(args.output, "w") as out:
+            generate(out, **parameters)
+    else:
+        generate(sys.stdout, **parameters)
+
+if __name__ == '__main__':
+    main()
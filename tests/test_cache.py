@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+import cache
+from postings import Accounts, Commodities, PostingTable, Prices, exact
+
+TRANSACTIONS = """\
+2020-01-01 Shop
+    ; a note
+    Expenses:Food  10 EUR
+    Assets:Bank
+
+P 2020-01-02 USD 0.9 EUR
+; a comment
+"""
+
+@pytest.mark.parametrize("directives", [
+    "alias food=Expenses:Food\n",
+    "apply account Personal\n",
+    "year 2021\n",
+    "Y2021\n",
+    "D 1,000.00 EUR\n",
+    "A Assets:Cash\n",
+    "= /Food/\n    Budget  -1\n",
+    "2020-01-01 X\n    Assets:Bank  = 100 EUR\n    Equity\n",
+    "account Expenses:Food\n    alias food\n",
+    "account Expenses:Food\n    ; where it goes\n    alias food\n",
+    "payee Shop\n    alias SHOP LTD\n",
+    "account Assets:Cash\n    default\n",
+    "commodity EUR\n    default\n",
+])
+def test_contextual(directives):
+    assert cache.CONTEXTUAL.search(TRANSACTIONS + directives + TRANSACTIONS)
+    assert not cache.standalone(directives + TRANSACTIONS)
+
+@pytest.mark.parametrize("directives", [
+    "",
+    "account Expenses:Food\n",
+    "account Expenses:Food\n\n" + TRANSACTIONS,
+    "payee Shop\n; not one of its children\n",
+])
+def test_not_contextual(directives):
+    assert not cache.CONTEXTUAL.search(TRANSACTIONS + directives + TRANSACTIONS)
+
+def test_standalone():
+    assert cache.standalone(TRANSACTIONS)
+    assert cache.standalone("\n" + TRANSACTIONS)
+    # carries on with the transaction before it
+    assert not cache.standalone("    Expenses:Food  1 EUR\n")
+    assert not cache.standalone("account Expenses:Food\n" + TRANSACTIONS)
+
+def test_contextual_stamp(tmp_path):
+    journal = tmp_path / "journal.ledger"
+    journal.write_text(TRANSACTIONS)
+    stamp = cache.fingerprint(str(journal))
+    assert not cache.contextual(stamp)
+
+    journal.write_text(TRANSACTIONS + "payee Shop\n    alias SHOP LTD\n" + TRANSACTIONS)
+    assert cache.contextual(cache.fingerprint(str(journal)))
+    # only what was there when the fingerprint was taken counts
+    assert not cache.contextual(stamp)
+
+def test_save_load_wide(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    journal = tmp_path / "journal.ledger"
+    journal.write_text(TRANSACTIONS)
+    stamp = cache.fingerprint(str(journal))
+
+    accounts, commodities = Accounts(["", "A"]), Commodities(["JPY"], [12])
+    quantity = exact([9 * 10 ** 30, -(9 * 10 ** 30) + 1])
+    table = PostingTable(np.array([1, 2], dtype=np.int32), np.array([1, 1], dtype=np.int32),
+                         np.array([0, 0], dtype=np.int32), quantity, accounts, commodities)
+    prices = Prices(*(np.zeros(0, dtype=dtype) for dtype in (np.int32, np.int32, np.int32, float)))
+    cache.save(str(journal), False, table, prices, {}, stamp)
+
+    loaded, _, _ = cache.load(str(journal), False, stamp)
+    assert loaded.quantity.tolist() == quantity.tolist()
+    assert loaded.commodities.decimals == [12]
@@ -0,0 +1,65 @@
+from decimal import Decimal
+
+import numpy as np
+import pytest
+
+import postings
+from postings import exact, running, scaled, units
+
+def test_units():
+    assert units(Decimal("1.000000000001"), 12) == 1000000000001
+    assert units(Decimal("-2.5"), 3) == -2500
+    assert units(Decimal("1E+3"), 0) == 1000
+    assert units(Decimal("1.500"), 1) == 15
+    with pytest.raises(ValueError):
+        units(Decimal("1.25"), 1)
+
+def test_exact():
+    assert exact([1, -2, 3]).dtype == np.int64
+    big = exact([2 ** 62, -(2 ** 62), 1])
+    assert big.dtype == object and big.tolist() == [2 ** 62, -(2 ** 62), 1]
+    assert exact([2 ** 70]).tolist() == [2 ** 70]
+    # each fits, their total might not
+    assert exact(np.array([2 ** 61, 2 ** 61], dtype=np.int64)).dtype == object
+
+def test_scaled():
+    quantities = np.array([1, -2, 3], dtype=np.int64)
+    assert scaled(quantities, np.array([0, 1, 2])).tolist() == [1, -20, 300]
+    assert scaled(quantities, np.array([20, 0, 0])).tolist() == [10 ** 20, -2, 3]
+
+def test_running_wide():
+    keys = np.array([0, 1, 0, 0, 1], dtype=np.int64)
+    dates = np.array([1, 1, 2, 2, 3], dtype=np.int32)
+    quantities = exact([2 ** 62, 5, 2 ** 62, 1, -5])
+    keys, dates, totals = running(keys, dates, quantities)
+    assert keys.tolist() == [0, 0, 1, 1]
+    assert dates.tolist() == [1, 2, 1, 3]
+    assert totals.tolist() == [2 ** 62, 2 ** 63 + 1, 5, 0]
+
+@pytest.fixture
+def sharding(monkeypatch):
+    """running() splitting even small tables across 4 threads"""
+    before = postings.threads if postings.pool is not None else 0
+    monkeypatch.setattr(postings, "SHARD_SIZE", 64)
+    postings.parallel(4)
+    yield
+    postings.parallel(before)
+
+@pytest.mark.parametrize("seed", range(8))
+@pytest.mark.parametrize("cumulative", [True, False])
+def test_sharded(sharding, seed, cumulative):
+    random = np.random.default_rng(seed)
+    size = int(random.integers(2 * 64, 4000))
+    # few dates so that they come in long runs the shards would split
+    dates = np.sort(random.integers(737000, 737000 + size // 50 + 2, size)).astype(np.int32)
+    keys = random.integers(0, 12, size).astype(np.int64)
+    quantities = random.integers(-10 ** 9, 10 ** 9, size)
+    splits = np.arange(1, 4) * size // 4
+    assert (dates[splits - 1] == dates[splits]).any()
+
+    expected = postings._running(keys, dates, quantities, cumulative)
+    for got in (postings.sharded(keys, dates, quantities, cumulative),
+                running(keys, dates, quantities, cumulative)):
+        for a, b in zip(got, expected):
+            assert a.dtype == b.dtype
+            assert np.array_equal(a, b)
@@ -0,0 +1,97 @@
+import pytest
+
+import query
+from postings import PostingTable
+
+JOURNAL = """\
+2020/01/05 Grocery Store
+    ; :holiday:
+    Expenses:Food              12.50 EUR
+    Liabilities:Card
+
+2020/02/01 Landlord
+    Expenses:Rent             700.00 EUR
+    ; Project: alpha
+    Assets:Bank
+
+2020/02/15 ACME Corp
+    Assets:Bank              2500.00 EUR
+    Income:Salary
+    ; Payee: Employer
+
+2020/03/10 Grocery Store
+    Expenses:Food               8.20 EUR
+    ; Project: beta
+    Assets:Bank
+
+2020/06/30 Corner Shop
+    ; :holiday:
+    Expenses:Food:Snacks        3.10 EUR
+    Assets:Cash
+
+2021/01/02 Landlord
+    Expenses:Rent             720.00 EUR
+    Assets:Bank
+"""
+
+SUPPORTED = [
+    "food",
+    "^exp",
+    "expenses and not food",
+    "food or rent",
+    "food rent",
+    "!food",
+    "account bank",
+    "payee grocery",
+    "desc landlord",
+    "@acme",
+    "payee employer",
+    "%holiday",
+    "not %holiday",
+    "tag project",
+    "%project=alpha",
+    "(food or bank) and payee store",
+    "food | rent & not snacks",
+    "expenses -b 2020/06",
+    "-e 2021 assets",
+    "-p 2020/03",
+    "assets --begin 2020/02/15 --end 2020/12",
+]
+
+UNSUPPORTED = ["{} food".format(term) for term in sorted(query.UNSUPPORTED)] + [
+    "expr 'amount > 10'",
+    "=groceries",
+    "#123",
+    "--related food",
+    "-p 'last month'",
+    "(food",
+    "food and",
+    "'food",
+    "food )",
+]
+
+@pytest.fixture(scope="module")
+def journal(tmp_path_factory):
+    pytest.importorskip("ledger")
+    from datasource import Journal
+    filename = tmp_path_factory.mktemp("query") / "journal.ledger"
+    filename.write_text(JOURNAL)
+    return Journal(str(filename), effective_date=False, use_cache=False)
+
+def rows(table):
+    names, accounts = table.names.names, table.accounts.names
+    return sorted(zip(table.date.tolist(), (accounts[id] for id in table.account.tolist()),
+                      table.quantity.tolist(), (names[id] for id in table.payee.tolist())))
+
+@pytest.mark.parametrize("text", SUPPORTED)
+def test_same_as_ledger(journal, text):
+    table = journal.postings()
+    ours = table.select(query.evaluate(text, table))
+    theirs = PostingTable.from_posts(journal.entries(text), table)
+    assert rows(ours) == rows(theirs)
+    assert len(ours)
+
+@pytest.mark.parametrize("text", UNSUPPORTED)
+def test_unsupported(text):
+    with pytest.raises(query.Unsupported):
+        query.evaluate(text, PostingTable.from_posts([]))
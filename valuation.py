@@ -0,0 +1,126 @@
+import datetime
+from collections import OrderedDict
+
+import numpy as np
+
+import profiling
+
+class Valuation:
+    """Converts amounts between commodities using a sorted timeline of rates
+       per pair, built once from the journal's price history (or from ledger
+       for pairs that history has nothing on, unless it all came from the disk
+       cache and ledger would have to parse the journal just for that)"""
+    def __init__(self, journal, cache_size=1 << 16):
+        self.journal = journal
+        self.timelines = {}
+        self.hinted = set()
+
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    def hint(self, symbol):
+        """Exchange does not always seem to pick up the conversion even when
+           available. We can try and hint it with a price the commodity was
+           annotated with"""
+        hints = self.journal.postings().hints
+        if symbol in self.hinted or symbol not in hints:
+            return False
+        self.hinted.add(symbol)
+
+        pool = self.journal.commodities
+        pool.exchange(pool.find(symbol), self.journal.ledger.Amount(hints[symbol]))
+        return True
+
+    def timeline(self, source, target):
+        """Returns (dates, rates, latest) for converting source to target,
+           the rate in effect on a date is the last one on or before it"""
+        key = (source, target)
+        if key not in self.timelines:
+            self.timelines[key] = self._timeline(source, target)
+        return self.timelines[key]
+
+    def _timeline(self, source, target):
+        empty = np.zeros(0, dtype=np.int32), np.zeros(0)
+        if not source or not target:
+            return empty + (0.0,)
+        if source == target:
+            return np.zeros(1, dtype=np.int32), np.ones(1), 1.0
+
+        prices = self.journal.prices
+        index = self.journal.postings().commodities.index
+        pair = (prices.source == index.get(source)) & (prices.target == index.get(target))
+        if pair.any():
+            dates, rates = prices.date[pair], prices.rate[pair]
+            order = np.argsort(dates, kind="stable")
+            return dates[order], rates[order], rates[order][-1]
+
+        # what came from the disk cache is all there is without a reparse
+        if not self.journal.cold:
+            return empty + (0.0,)
+        return self.sample(source, target) or empty + (0.0,)
+
+    @profiling.timed()
+    def sample(self, source, target):
+        """Asks ledger for the rate on every date there is a posting on"""
+        ledger = self.journal.ledger
+        with self.journal.lock:
+            pool = self.journal.commodities
+            commodity, other = pool.find(source), pool.find(target)
+            if not commodity or not other:
+                return None
+
+            unit = ledger.Amount("1")
+            unit.commodity = commodity
+            latest = unit.value(other)
+            if latest is None and self.hint(source):
+                latest = unit.value(other)
+            if latest is None:
+                return None
+
+            dates = np.unique(self.journal.postings().date)
+            rates = np.zeros(len(dates))
+            for i, date in enumerate(dates.tolist()):
+                value = unit.value(other, datetime.date.fromordinal(date))
+                if value is not None:
+                    rates[i] = float(value.number())
+
+        # only keep the dates the rate changes on
+        changed = np.r_[True, rates[1:] != rates[:-1]]
+        return dates[changed], rates[changed], float(latest.number())
+
+    def rate(self, source, target, date=None):
+        """What one unit of source is worth in target on date (now if None)"""
+        key = (source, target, date)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        dates, rates, latest = self.timeline(source, target)
+        if date is None:
+            rate = latest
+        else:
+            i = np.searchsorted(dates, date.toordinal(), side="right") - 1
+            rate = float(rates[i]) if i >= 0 else 0.0
+
+        self.cache[key] = rate
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return rate
+
+    def rates(self, source, target, dates):
+        """Vectorized rate() for an array of date ordinals"""
+        timeline, rates, _ = self.timeline(source, target)
+        i = np.searchsorted(timeline, dates, side="right") - 1
+        return np.where(i >= 0, rates[np.maximum(i, 0)] if len(rates) else 0.0, 0.0)
+
+    def latest(self, target, symbols):
+        """The current rate of each of symbols to target"""
+        return np.array([self.timeline(symbol, target)[2] for symbol in symbols])
+
+    def value(self, amount, target, date=None):
+        """What a ledger Amount or Balance is worth in target, as a number,
+           0 where there is no known price"""
+        if isinstance(amount, self.journal.ledger.Amount):
+            amount = [amount]
+        return sum(float(component.number()) * self.rate(component.commodity.symbol, target, date)
+                   for component in amount)
@@ -0,0 +1,134 @@
+import sys
+import threading
+from collections import OrderedDict, defaultdict
+from contextlib import nullcontext
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+import profiling
+
+class Cancelled(Exception):
+    pass
+
+class Job:
+    def __init__(self, worker, owner, function, callback, failed, description, partial=None):
+        self.worker = worker
+        self.owner = owner
+        self.generation = worker.generations[owner]
+        self.function = function
+        self.callback = callback
+        self.failed = failed
+        self.description = description
+        self.partial = partial
+        # the latest partial result not handed over yet, only it is shown
+        self.latest = None
+        self.lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self.worker.generations[self.owner] != self.generation
+
+    def progress(self, count):
+        """Called by the computation as it goes, stops it if a newer job from
+           the same owner has been submitted since"""
+        if self.cancelled:
+            raise Cancelled()
+        self.worker.progress.emit(self.description, count)
+
+    def snapshot(self, result):
+        """Called by the computation with what it has so far, partial(result)
+           gets the latest of those on the GUI thread while the job runs"""
+        if self.cancelled:
+            raise Cancelled()
+        if not self.partial:
+            return
+        with self.lock:
+            waiting, self.latest = self.latest is not None, result
+        if not waiting:
+            self.worker.snapshot.emit(self)
+
+    def take(self):
+        with self.lock:
+            result, self.latest = self.latest, None
+        return result
+
+class Worker(QObject):
+    """Runs journal computations one at a time on a thread of its own (ledger
+       only has the one session) and hands the results back on the GUI thread.
+
+       Each owner only ever has its latest job run, anything it submitted
+       before is dropped or stopped at the next progress report."""
+    finished = pyqtSignal(object, object)
+    error = pyqtSignal(object, object)
+    progress = pyqtSignal(str, int)
+    snapshot = pyqtSignal(object)
+    busy = pyqtSignal(bool)
+
+    def __init__(self, parent=None):
+        super(Worker, self).__init__(parent)
+        self.generations = defaultdict(int)
+        self.pending = OrderedDict()
+        self.condition = threading.Condition()
+
+        self.finished.connect(self.deliver)
+        self.error.connect(self.report)
+        self.snapshot.connect(self.show)
+
+        self.thread = threading.Thread(target=self.run, name="journal worker", daemon=True)
+        self.thread.start()
+
+    def submit(self, owner, function, callback, failed=None, description="", partial=None):
+        """Queues function(job) to be run, callback(result) or failed(exception)
+           is then called on the GUI thread unless the job has been superseded,
+           as is partial(result) for what it hands to job.snapshot()"""
+        with self.condition:
+            self.generations[owner] += 1
+            self.pending.pop(owner, None)
+            job = self.pending[owner] = Job(self, owner, function, callback, failed, description,
+                                            partial)
+            self.condition.notify()
+        return job
+
+    def cancel(self, owner):
+        with self.condition:
+            self.generations[owner] += 1
+            self.pending.pop(owner, None)
+
+    def run(self):
+        while True:
+            with self.condition:
+                if not self.pending:
+                    self.busy.emit(False)
+                while not self.pending:
+                    self.condition.wait()
+                _, job = self.pending.popitem(last=False)
+
+            self.busy.emit(True)
+            # ledger's lock, if it has been loaded at all (not by thin clients)
+            datasource = sys.modules.get("datasource")
+            try:
+                with datasource.lock if datasource else nullcontext(), \
+                        profiling.span(job.description or "job"):
+                    result = job.function(job)
+            except Cancelled:
+                continue
+            except Exception as e:
+                self.error.emit(job, e)
+            else:
+                self.finished.emit(job, result)
+
+    def show(self, job):
+        result = job.take()
+        if result is not None and not job.cancelled:
+            job.partial(result)
+
+    def deliver(self, job, result):
+        if not job.cancelled:
+            job.callback(result)
+
+    def report(self, job, exception):
+        if job.cancelled:
+            return
+        if not job.failed:
+            raise exception
+        job.failed(exception)